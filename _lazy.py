@@ -0,0 +1,33 @@
+"""Module with lazy import helper used to defer loading of heavy dependencies.
+"""
+import importlib
+
+class LazyModule:
+    """Placeholder for a module, which is imported on first attribute access.
+
+    After import the placeholder replaces itself in passed namespace with the
+    real module, so later accesses cost nothing extra.
+
+    Args:
+        name (string): Full name of module to import, e.g. 'pyglet.gl'.
+        namespace (dict): Globals of the module the placeholder is assigned in.
+        alias (string): Name of the placeholder in namespace.
+
+    Example:
+        gl = LazyModule('pyglet.gl', globals(), 'gl')
+    """
+    def __init__(self, name, namespace, alias):
+        self._name = name
+        self._namespace = namespace
+        self._alias = alias
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+            if self._namespace.get(self._alias) is self:
+                self._namespace[self._alias] = self._module
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        return "<lazy module '{}'>".format(self._name)
@@ -0,0 +1,64 @@
+"""Benchmark of package import time.
+
+Each module is imported in a fresh interpreter, once alone (lazy, as workers
+do) and once together with cv2, pyglet.gl and gym_duckietown.simulator (what
+importing it used to cost when these were imported eagerly). Run from the
+parent directory of the package:
+
+    python -m bachelor.benchmarks.bench_import --repeat 10 --output import.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+HEAVY_MODULES = ['cv2', 'pyglet.gl', 'gym_duckietown.simulator']
+
+MEASURE = """
+import json, sys, time
+start = time.perf_counter()
+import {modules}
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    'seconds': elapsed,
+    'loaded': [name for name in {heavy!r} if name in sys.modules],
+}}))
+"""
+
+def measure(modules, cwd):
+    """Returns import time and loaded heavy modules of importing modules in a new interpreter."""
+    code = MEASURE.format(modules=", ".join(modules), heavy=HEAVY_MODULES)
+    out = subprocess.run([sys.executable, '-c', code], cwd=cwd, check=True,
+        stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=5, help="Interpreters started per measurement.")
+    parser.add_argument('--output', help="Path of JSON results. Printed to stdout if not passed.")
+    args = parser.parse_args(argv)
+
+    package = __package__.rsplit('.', 1)[0]
+    cwd = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    results = {}
+    for module in ['info', 'drawable', 'recorder']:
+        name = "{}.{}".format(package, module)
+        for mode, modules in [('lazy', [name]), ('eager', HEAVY_MODULES + [name])]:
+            runs = [measure(modules, cwd) for _ in range(args.repeat)]
+            times = sorted(run['seconds'] for run in runs)
+            results['{}/{}'.format(module, mode)] = {
+                'median': times[len(times) // 2],
+                'min': times[0],
+                'loaded': runs[0]['loaded'],
+            }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+"""Benchmarks of recorder pipeline, drawables and infos on a stub environment.
+
+Run from the parent directory of the package, e.g. under software GL without
+display:
+
+    LIBGL_ALWAYS_SOFTWARE=1 xvfb-run -a python -m bachelor.benchmarks.bench_recorder \
+        --grid 30 --objects 50 --curves --output results.json
+
+Without X server the environment can be built in an offscreen context:
+
+    python -m bachelor.benchmarks.bench_recorder --headless egl
+
+Results are written as JSON with frames per second and per-stage latency
+statistics (see profiler.RenderProfiler.stats) of every benchmark.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+from .. import drawable
+from .. import info
+from .._lazy import LazyModule
+from ..camera import CameraSettings
+from ..context import HeadlessContext
+from ..framebuffer import Framebuffer
+from ..profiler import RenderProfiler
+from ..recorder import Recorder, RecorderSubFrame, RecorderBotViewSubFrame, RecorderInfoSubFrame
+from .stub_env import StubEnv
+
+# OSMesa context must be created before pyglet.gl is imported
+gl = LazyModule('pyglet.gl', globals(), 'gl')
+gl_info = LazyModule('pyglet.gl.gl_info', globals(), 'gl_info')
+
+def overview_camera(env, width, height):
+    """Orthogonal camera looking at the whole map from above."""
+    center = [env.grid_width * env.road_tile_size / 2, 5, env.grid_height * env.road_tile_size / 2]
+    scale = min(width, height) / (max(env.grid_width, env.grid_height) * env.road_tile_size)
+    return CameraSettings(width, height,
+        lambda env: center,
+        lambda env: [0, -1, 0],
+        lambda env: [0, 0, -1],
+        projection = 'orthogonal',
+        scale = scale
+    )
+
+def chase_camera(width, height):
+    """Perspective camera following the bot."""
+    return CameraSettings(width, height,
+        lambda env: env.cur_pos - env.get_dir_vec() * 0.6 + np.array([0, 0.4, 0]),
+        lambda env: env.get_dir_vec() - np.array([0, 0.5, 0]),
+        lambda env: [0, 1, 0]
+    )
+
+def info_texts(env):
+    infos = [
+        info.BotPos(env, "pos: "),
+        info.BotAngle(env, "angle: "),
+        info.BotSpeed(env, "speed: "),
+        info.IsInLane(env, "in lane: "),
+        info.Distance(env, "distance: "),
+        info.TimeOutOfLane(env, "out of lane: "),
+    ]
+    return [drawable.Text((10, 10 + 20 * i), infos[i]) for i in range(len(infos))]
+
+def make_layouts(env):
+    """Returns dict of layout name to function setting subframes of a recorder."""
+    def single(recorder):
+        recorder.set_subframe(0, 0, RecorderSubFrame(chase_camera(640, 480)))
+
+    def overview(recorder):
+        recorder.set_subframe(0, 0, RecorderSubFrame(overview_camera(env, 640, 640)))
+
+    def composite(recorder):
+        recorder.set_subframe(0, 0, RecorderSubFrame(overview_camera(env, 640, 480)))
+        recorder.set_subframe(0, 1, RecorderSubFrame(chase_camera(640, 480)))
+        recorder.set_subframe(1, 0, RecorderBotViewSubFrame(640, 480))
+        recorder.set_subframe(1, 1, RecorderInfoSubFrame(640, 480, info_texts(env)))
+
+    return {
+        '1x1_chase': ((1, 1), single),
+        '1x1_overview': ((1, 1), overview),
+        '2x2_composite': ((2, 2), composite),
+    }
+
+def bench_layouts(env, frames, tmpdir):
+    results = {}
+    for name, (shape, setup) in make_layouts(env).items():
+        for readback in ('sync', 'async'):
+            env.reset()
+            recorder = Recorder(os.path.join(tmpdir, name + '.mp4'), shape, env,
+                readback=readback, profile=True)
+            setup(recorder)
+            recorder.render() # Warm up: layout, framebuffers, caches
+            start = time.perf_counter()
+            for _ in range(frames):
+                env.step()
+                recorder.render()
+            gl.glFinish()
+            elapsed = time.perf_counter() - start
+            recorder.close()
+            results['{}/{}'.format(name, readback)] = {
+                'fps': frames / elapsed,
+                'stages': recorder.profiler.stats(),
+            }
+    return results
+
+def bench_drawables(env, frames):
+    """Times each drawable alone in a framebuffer with chase and overview cameras."""
+    results = {}
+    fb = Framebuffer(640, 480, env.shadow_window)
+    cameras = {'chase': chase_camera(640, 480), 'overview': overview_camera(env, 640, 480)}
+    drawers = {'Tiles': drawable.Tiles(), 'Objects': drawable.Objects(), 'Bot': drawable.Bot()}
+    for camera_name, camera in cameras.items():
+        for drawer_name, drawer in drawers.items():
+            profiler = RenderProfiler()
+            env.reset()
+            fb.use()
+            camera.use(env)
+            drawer.draw(env) # Warm up caches
+            for _ in range(frames):
+                env.step()
+                camera.use(env)
+                with profiler.section('draw'):
+                    drawer.draw(env)
+                profiler.end_frame()
+            profiler.release()
+            results['{}/{}'.format(drawer_name, camera_name)] = profiler.stats()['draw']
+    gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, 0)
+    fb.release()
+    return results
+
+def bench_infos(env, steps):
+    """Times evaluation of infos on each step, as Text drawers do."""
+    results = {}
+    makers = {
+        'BotPos': info.BotPos,
+        'BotAngle': info.BotAngle,
+        'BotDirection': info.BotDirection,
+        'IsInLane': info.IsInLane,
+        'Distance': info.Distance,
+        'TimeOutOfLane': info.TimeOutOfLane,
+        'TimeInactive': info.TimeInactive,
+    }
+    for name, maker in makers.items():
+        env.reset()
+        obj = maker(env)
+        profiler = RenderProfiler(window=steps, gpu=False)
+        for _ in range(steps):
+            env.step()
+            with profiler.section('get_str', gpu=False):
+                obj.get_str()
+        results[name] = profiler.stats()['get_str']['cpu']
+    return results
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--grid', type=int, default=30, help="Tiles along each side of the map.")
+    parser.add_argument('--objects', type=int, default=50, help="Number of objects on the map.")
+    parser.add_argument('--curves', action='store_true', help="Draw lane curves.")
+    parser.add_argument('--frames', type=int, default=200, help="Frames rendered per benchmark.")
+    parser.add_argument('--output', help="Path of JSON results. Printed to stdout if not passed.")
+    parser.add_argument('--headless', choices=['egl', 'osmesa'],
+        help="Render in offscreen context of passed backend instead of hidden window.")
+    args = parser.parse_args(argv)
+
+    context = HeadlessContext(args.headless) if args.headless else None
+    env = StubEnv(grid_size=args.grid, object_count=args.objects, draw_curve=args.curves,
+        context=context)
+    env.shadow_window.switch_to()
+    results = {
+        'config': vars(args),
+        'gl_renderer': gl_info.get_renderer(),
+        'gl_version': gl_info.get_version(),
+    }
+    with tempfile.TemporaryDirectory() as tmpdir:
+        results['recorder'] = bench_layouts(env, args.frames, tmpdir)
+    env.shadow_window.switch_to()
+    results['drawables'] = bench_drawables(env, args.frames)
+    results['infos'] = bench_infos(env, args.frames * 10)
+    if context:
+        context.release()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+if __name__ == '__main__':
+    main()
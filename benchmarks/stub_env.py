@@ -0,0 +1,177 @@
+"""Lightweight stand-in for gym_duckietown environment used by benchmarks.
+
+Provides attributes and methods used by recorder, drawables and infos without
+loading maps, meshes or textures from gym_duckietown.
+"""
+from collections import namedtuple
+import math
+import numpy as np
+from .._lazy import LazyModule
+
+# Imported lazily, so OSMesa context can be created before pyglet.gl
+pyglet = LazyModule('pyglet', globals(), 'pyglet')
+gl = LazyModule('pyglet.gl', globals(), 'gl')
+
+LanePosition = namedtuple('LanePosition', 'dist dot_dir angle_deg angle_rad')
+
+class NotInLane(Exception):
+    """Raised by StubEnv.get_lane_pos2, like gym_duckietown's NotInLane."""
+    pass
+
+class StubTexture:
+    """Solid color texture with the same bind interface as gym_duckietown's Texture."""
+    def __init__(self, color):
+        pattern = pyglet.image.SolidColorImagePattern(tuple(color) + (255,))
+        self.tex = pattern.create_image(64, 64).get_texture()
+
+    def bind(self):
+        gl.glBindTexture(self.tex.target, self.tex.id)
+
+class StubObject:
+    """Box standing on the ground, drawn with immediate mode like WorldObj.render."""
+    def __init__(self, pos, size = 0.1, static = True):
+        self.pos = np.array(pos, dtype=float)
+        self.size = size
+        self.static = static
+        self.angle = 0.0
+
+    def render(self, draw_bbox):
+        s = self.size / 2
+        x, _, z = self.pos
+        gl.glColor3f(1, 1, 0)
+        gl.glBegin(gl.GL_QUADS)
+        for y in (0, self.size):
+            gl.glVertex3f(x - s, y, z - s)
+            gl.glVertex3f(x + s, y, z - s)
+            gl.glVertex3f(x + s, y, z + s)
+            gl.glVertex3f(x - s, y, z + s)
+        gl.glEnd()
+        gl.glColor3f(1, 1, 1)
+
+class StubMesh:
+    def render(self):
+        gl.glColor3f(1, 0, 0)
+        gl.glBegin(gl.GL_TRIANGLES)
+        gl.glVertex3f(-0.1, 0.05, -0.06)
+        gl.glVertex3f(-0.1, 0.05, 0.06)
+        gl.glVertex3f(0.1, 0.05, 0)
+        gl.glEnd()
+        gl.glColor3f(1, 1, 1)
+
+class StubEnv:
+    """Environment with square grid of tiles and a bot driving in circles.
+
+    Args:
+        grid_size (int): Number of tiles along each side of the map.
+        object_count (int): Number of objects placed on the map.
+        draw_curve (bool): Should lane curves be drawn by Tiles or not.
+        context: OpenGL context object with switch_to method. If none passed,
+            hidden pyglet window is created.
+        seed (int): Seed of random generator placing tiles and objects.
+    """
+    NotInLane = NotInLane # Exception type infos catch when bot isn't in lane
+
+    def __init__(self, grid_size = 30, object_count = 50, draw_curve = False,
+        context = None, seed = 0
+    ):
+        self.shadow_window = context or pyglet.window.Window(width=1, height=1, visible=False)
+        self.shadow_window.switch_to()
+        rng = np.random.RandomState(seed)
+
+        self.grid_width = self.grid_height = grid_size
+        self.road_tile_size = 0.585
+        self.draw_curve = draw_curve
+        self.domain_rand = False
+        self.frame_rate = 30
+        self.delta_time = 1.0 / self.frame_rate
+
+        textures = [StubTexture(color) for color in [(90, 90, 90), (60, 160, 60), (200, 200, 200)]]
+        self.grid = []
+        for j in range(grid_size):
+            for i in range(grid_size):
+                drivable = rng.rand() < 0.6
+                angle = int(rng.randint(4))
+                self.grid.append({
+                    'kind': 'straight' if drivable else 'floor',
+                    'angle': angle,
+                    'color': np.array([1.0, 1.0, 1.0]),
+                    'texture': textures[0] if drivable else textures[1 + rng.randint(2)],
+                    'drivable': drivable,
+                    'curves': self._straight_curves(i, j, angle) if drivable else None,
+                })
+
+        half = self.road_tile_size / 2
+        self.road_vlist = pyglet.graphics.vertex_list(4,
+            ('v3f', [-half, 0, -half, half, 0, -half, half, 0, half, -half, 0, half]),
+            ('t2f', [1.0, 0.0, 0.0, 0.0, 0.0, 1.0, 1.0, 1.0]))
+        self.ground_vlist = pyglet.graphics.vertex_list(4,
+            ('v3f', [-1, -0.8, -1, 1, -0.8, -1, 1, -0.8, 1, -1, -0.8, 1]))
+        self.tri_vlist = pyglet.graphics.vertex_list(3,
+            ('v3f', [0, -0.7, 0, 1, -0.7, 0, 0, -0.7, 1]))
+        self.horizon_color = [0.64, 0.71, 0.28]
+        self.ground_color = [0.15, 0.15, 0.15]
+
+        size = grid_size * self.road_tile_size
+        self.objects = [StubObject((rng.rand() * size, 0, rng.rand() * size))
+            for _ in range(object_count)]
+        self.mesh = StubMesh()
+
+        self.camera_width, self.camera_height = 640, 480
+        self.cam_fov_y = 75
+        self.cam_offset = np.array([0, 0, 0])
+        self.cam_height = 0.1
+        self.cam_angle = [15, 0, 0]
+        self.camera_forward_dist = 0.066 # Simulator's CAMERA_FORWARD_DIST
+        self.randomization_settings = {}
+        self.reset()
+
+    def reset(self):
+        self.step_count = 0
+        self.center = np.array([self.grid_width, 0, self.grid_height]) * self.road_tile_size / 2
+        self.radius = self.grid_width * self.road_tile_size / 4
+        self.cur_angle = 0.0
+        self.speed = 0.3
+        self.cur_pos = self._circle_pos(0.0)
+
+    def step(self):
+        """Moves bot along a circle around the center of the map."""
+        self.step_count += 1
+        phase = self.step_count * self.delta_time * self.speed / self.radius
+        self.cur_pos = self._circle_pos(phase)
+        self.cur_angle = phase + math.pi / 2
+
+    def _circle_pos(self, phase):
+        return self.center + self.radius * np.array([math.cos(phase), 0, -math.sin(phase)])
+
+    def _straight_curves(self, i, j, angle):
+        """Two straight lanes through tile in Bezier control points form."""
+        size = self.road_tile_size
+        center = np.array([(i + 0.5) * size, 0, (j + 0.5) * size])
+        dir = self.get_dir_vec(angle * math.pi / 2)
+        side = np.array([-dir[2], 0, dir[0]])
+        t = np.linspace(-0.5, 0.5, 4).reshape(-1, 1) * size
+        lane = center + t * dir
+        return np.array([lane + side * size / 4, (lane - side * size / 4)[::-1]])
+
+    def _get_tile(self, i, j):
+        if i < 0 or i >= self.grid_width or j < 0 or j >= self.grid_height:
+            return None
+        return self.grid[j * self.grid_width + i]
+
+    def _perturb(self, val, scale = 0.1):
+        return val
+
+    def get_dir_vec(self, angle = None):
+        if angle is None:
+            angle = self.cur_angle
+        return np.array([math.cos(angle), 0, -math.sin(angle)])
+
+    def get_lane_pos2(self, pos, angle):
+        i = int(pos[0] // self.road_tile_size)
+        j = int(pos[2] // self.road_tile_size)
+        tile = self._get_tile(i, j)
+        if tile is None or not tile['drivable']:
+            raise NotInLane('Point not in lane: {}'.format(pos))
+        center = (np.array([i, j]) + 0.5) * self.road_tile_size
+        dist = float(np.linalg.norm(np.array([pos[0], pos[2]]) - center))
+        return LanePosition(dist, 1.0, 0.0, 0.0)
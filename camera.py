@@ -1,14 +1,26 @@
-from pyglet import gl
+from math import tan, radians
+import numpy as np
+from ._lazy import LazyModule
+
+gl = LazyModule('pyglet.gl', globals(), 'gl')
 
 class CameraSettings:
     """Class for camera settings.
 
+    Projection matrix is computed once and cached until width, height,
+    projection or scale change. Both projection and view matrices are
+    available as numpy arrays for reuse (e.g. by culling).
+
     Args:
         width, height: Width and height of a camera
         pos_getter, dir_getter, up_getter: Getters used for camera position and rotation. If none passed, identity matrix is used.
         projection(perspective/orthogonal): Projection to use in camera
         scale(float): Scaling factor used when rendering objects
     """
+    FOV_Y = 45.0
+    NEAR  = 0.04
+    FAR   = 100.0
+
     def __init__(self, width, height, pos_getter, dir_getter, up_getter, projection = 'perspective', scale = 1.0):
         self.pos_getter = pos_getter
         self.dir_getter = dir_getter
@@ -20,6 +32,43 @@ class CameraSettings:
         self.height = height
         assert scale > 0
         self.scale = scale
+        self._projection_key = None
+        self._projection_gl = None # GLfloat array of cached matrix, made in use
+
+    def projection_matrix(self):
+        """Returns 4x4 projection matrix (column vector convention).
+
+        Note: Returned array is cached and shouldn't be modified.
+        """
+        key = (self.width, self.height, self.projection, self.scale)
+        if key != self._projection_key:
+            if self.projection == 'perspective':
+                matrix = _perspective(self.FOV_Y, self.width / float(self.height), self.NEAR, self.FAR)
+            else:
+                matrix = _ortho(-self.width/2, self.width/2, -self.height/2, self.height/2, -1, 10)
+            matrix = matrix @ np.diag([self.scale, self.scale, 1, 1])
+            self._projection = matrix
+            self._projection_gl = None
+            self._projection_key = key
+        return self._projection
+
+    def view_matrix(self, env, flip_vertically = False):
+        """Returns 4x4 view matrix (column vector convention) for environment.
+
+        Args:
+            env: Environment used in pos, dir, up getters.
+            flip_vertically: Should rendered image be flipped vertically or not.
+        """
+        if not (self.pos_getter and self.dir_getter and self.up_getter):
+            return np.identity(4)
+        pos = np.asarray(self.pos_getter(env), dtype=np.float64)
+        dir = np.asarray(self.dir_getter(env), dtype=np.float64)
+        up  = np.asarray(self.up_getter(env), dtype=np.float64)
+        # Invert up to flip image because OpenCV and OpenGL y-origins are
+        #   in opposite corners
+        if flip_vertically:
+            up = -up
+        return _look_at(pos, dir, up)
 
     def use(self, env, flip_vertically = False):
         """Load projection and view matrices for camera.
@@ -31,36 +80,51 @@ class CameraSettings:
         Note: If identity matrix (see constructor) is used then flip_vertically doesn't change anything.
         """
         # Projection matrix:
+        matrix = self.projection_matrix()
+        if self._projection_gl is None:
+            self._projection_gl = _to_gl(matrix)
         gl.glMatrixMode(gl.GL_PROJECTION)
-        gl.glLoadIdentity()
-        if self.projection == 'perspective':
-            gl.gluPerspective(
-                45.0,
-                self.width / float(self.height),
-                0.04,
-                100.0
-            )
-        elif self.projection == 'orthogonal':
-            width = self.width
-            height = self.height
-            gl.glOrtho(-width/2, width/2, -height/2, height/2, -1, 10)
-        gl.glScalef(self.scale, self.scale, 1)
+        gl.glLoadMatrixf(self._projection_gl)
 
         # View matrix:
         gl.glMatrixMode(gl.GL_MODELVIEW)
-        gl.glLoadIdentity()
         if self.pos_getter and self.dir_getter and self.up_getter:
-            pos = self.pos_getter(env)
-            dir = self.dir_getter(env)
-            tgt = list([pos+dir for (pos, dir) in zip(pos, dir)])
-            # Invert up to flip image because OpenCV and OpenGL y-origins are
-            #   in opposite corners
-            if flip_vertically:
-                up  = list([-val for val in self.up_getter(env)])
-            else:
-                up  = self.up_getter(env)
-            gl.gluLookAt(
-                *pos, # Eye position
-                *tgt, # Target
-                *up # Up vector
-            )
\ No newline at end of file
+            gl.glLoadMatrixf(_to_gl(self.view_matrix(env, flip_vertically)))
+        else:
+            gl.glLoadIdentity()
+
+def _perspective(fov_y, aspect, near, far):
+    """Same matrix as gluPerspective."""
+    f = 1 / tan(radians(fov_y) / 2)
+    return np.array([
+        [f / aspect, 0, 0, 0],
+        [0, f, 0, 0],
+        [0, 0, (far + near) / (near - far), 2 * far * near / (near - far)],
+        [0, 0, -1, 0],
+    ])
+
+def _ortho(left, right, bottom, top, near, far):
+    """Same matrix as glOrtho."""
+    return np.array([
+        [2 / (right - left), 0, 0, -(right + left) / (right - left)],
+        [0, 2 / (top - bottom), 0, -(top + bottom) / (top - bottom)],
+        [0, 0, -2 / (far - near), -(far + near) / (far - near)],
+        [0, 0, 0, 1],
+    ])
+
+def _look_at(pos, dir, up):
+    """Same matrix as gluLookAt(*pos, *(pos + dir), *up)."""
+    f = dir / np.linalg.norm(dir)
+    s = np.cross(f, up)
+    s = s / np.linalg.norm(s)
+    u = np.cross(s, f)
+    matrix = np.identity(4)
+    matrix[0, :3] = s
+    matrix[1, :3] = u
+    matrix[2, :3] = -f
+    matrix[:3, 3] = -matrix[:3, :3] @ pos
+    return matrix
+
+def _to_gl(matrix):
+    """Converts numpy matrix to column-major GLfloat array used by glLoadMatrixf."""
+    return (gl.GLfloat * 16)(*matrix.T.ravel())
@@ -0,0 +1,197 @@
+"""Module with offscreen OpenGL contexts, which need no window or X server.
+"""
+import ctypes
+import ctypes.util
+import sys
+from ._lazy import LazyModule
+
+pyglet = LazyModule('pyglet', globals(), 'pyglet')
+
+# EGL constants
+EGL_NONE            = 0x3038
+EGL_SURFACE_TYPE    = 0x3033
+EGL_PBUFFER_BIT     = 0x0001
+EGL_RED_SIZE        = 0x3024
+EGL_GREEN_SIZE      = 0x3023
+EGL_BLUE_SIZE       = 0x3022
+EGL_ALPHA_SIZE      = 0x3021
+EGL_DEPTH_SIZE      = 0x3025
+EGL_RENDERABLE_TYPE = 0x3040
+EGL_OPENGL_BIT      = 0x0008
+EGL_WIDTH           = 0x3057
+EGL_HEIGHT          = 0x3056
+EGL_OPENGL_API      = 0x30A2
+EGL_PLATFORM_DEVICE_EXT = 0x313F
+
+# OSMesa constants
+OSMESA_RGBA      = 0x1908
+GL_UNSIGNED_BYTE = 0x1401
+
+class HeadlessContext:
+    """OpenGL context rendering offscreen without a window or X server.
+
+    Has the same switch_to method as pyglet windows, so it can be passed
+    anywhere env.shadow_window is used, e.g. to Recorder and Framebuffer.
+    Everything is drawn into framebuffers, so context's own surface is minimal.
+
+    Args:
+        backend(egl/osmesa): 'egl' creates context on a GPU through EGL (or on
+            Mesa's software renderer if EGL has no GPU). 'osmesa' renders on CPU
+            with OSMesa.
+        device: (optional) Index of EGL device (GPU) to use. If none passed,
+            EGL's default display is used.
+
+    Note:
+        With 'osmesa' the context must be created before pyglet.gl is imported,
+        because pyglet has to load OpenGL functions from OSMesa library.
+        OpenGL objects of environment (e.g. textures of tiles) must be created
+        while this context is current to be drawable in it. Stock gym_duckietown
+        Simulator creates them in its own pyglet window, so it can't be recorded
+        headless; environment has to accept the context, like
+        benchmarks.stub_env.StubEnv does.
+    """
+    def __init__(self, backend = 'egl', device = None):
+        if backend != 'egl' and backend != 'osmesa':
+            raise ValueError("Backend parameter is invalid.")
+        self.backend = backend
+        if 'pyglet.gl' not in sys.modules:
+            # Shadow window would need X server
+            pyglet.options['shadow_window'] = False
+        if backend == 'egl':
+            self._create_egl(device)
+        else:
+            self._create_osmesa()
+        self._pyglet_context = None
+        self.switch_to()
+
+    def _create_egl(self, device):
+        egl = _load_library('EGL')
+        egl.eglGetDisplay.restype = ctypes.c_void_p
+        egl.eglGetProcAddress.restype = ctypes.c_void_p
+        egl.eglGetProcAddress.argtypes = [ctypes.c_char_p]
+        egl.eglChooseConfig.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_int32),
+            ctypes.POINTER(ctypes.c_void_p), ctypes.c_int32, ctypes.POINTER(ctypes.c_int32)]
+        egl.eglCreatePbufferSurface.restype = ctypes.c_void_p
+        egl.eglCreatePbufferSurface.argtypes = [ctypes.c_void_p, ctypes.c_void_p,
+            ctypes.POINTER(ctypes.c_int32)]
+        egl.eglCreateContext.restype = ctypes.c_void_p
+        egl.eglCreateContext.argtypes = [ctypes.c_void_p, ctypes.c_void_p,
+            ctypes.c_void_p, ctypes.POINTER(ctypes.c_int32)]
+        egl.eglMakeCurrent.argtypes = [ctypes.c_void_p] * 4
+        egl.eglDestroySurface.argtypes = [ctypes.c_void_p] * 2
+        egl.eglDestroyContext.argtypes = [ctypes.c_void_p] * 2
+        egl.eglTerminate.argtypes = [ctypes.c_void_p]
+        self._egl = egl
+
+        if device is None:
+            display = egl.eglGetDisplay(ctypes.c_void_p(0)) # EGL_DEFAULT_DISPLAY
+        else:
+            display = _get_egl_device_display(egl, device)
+        if not display or not egl.eglInitialize(ctypes.c_void_p(display), None, None):
+            raise RuntimeError("Can't initialize EGL display (error 0x{:x}).".format(egl.eglGetError()))
+        self._display = display
+
+        config_attribs = _attrib_list(
+            EGL_SURFACE_TYPE, EGL_PBUFFER_BIT,
+            EGL_RED_SIZE, 8, EGL_GREEN_SIZE, 8, EGL_BLUE_SIZE, 8, EGL_ALPHA_SIZE, 8,
+            EGL_DEPTH_SIZE, 24,
+            EGL_RENDERABLE_TYPE, EGL_OPENGL_BIT,
+        )
+        config = ctypes.c_void_p()
+        count = ctypes.c_int32(0)
+        if not egl.eglChooseConfig(display, config_attribs, ctypes.byref(config), 1, ctypes.byref(count)) or count.value < 1:
+            raise RuntimeError("No EGL config supports desktop OpenGL.")
+        self._surface = egl.eglCreatePbufferSurface(display, config,
+            _attrib_list(EGL_WIDTH, 1, EGL_HEIGHT, 1))
+        # Desktop OpenGL (not ES), drawables use fixed function pipeline
+        egl.eglBindAPI(EGL_OPENGL_API)
+        self._context = egl.eglCreateContext(display, config, None, None)
+        if not self._surface or not self._context:
+            raise RuntimeError("Can't create EGL context (error 0x{:x}).".format(egl.eglGetError()))
+
+    def _create_osmesa(self):
+        osmesa = _load_library('OSMesa')
+        osmesa.OSMesaCreateContextExt.restype = ctypes.c_void_p
+        osmesa.OSMesaCreateContextExt.argtypes = [ctypes.c_uint, ctypes.c_int,
+            ctypes.c_int, ctypes.c_int, ctypes.c_void_p]
+        osmesa.OSMesaMakeCurrent.argtypes = [ctypes.c_void_p, ctypes.c_void_p,
+            ctypes.c_uint, ctypes.c_int, ctypes.c_int]
+        osmesa.OSMesaDestroyContext.argtypes = [ctypes.c_void_p]
+        self._osmesa = osmesa
+        if 'pyglet.gl' in sys.modules:
+            raise RuntimeError("OSMesa context must be created before pyglet.gl is imported.")
+        _load_gl_from(osmesa)
+
+        self._context = osmesa.OSMesaCreateContextExt(OSMESA_RGBA, 24, 8, 0, None)
+        if not self._context:
+            raise RuntimeError("Can't create OSMesa context.")
+        self._buffer = (ctypes.c_ubyte * 4)() # 1x1 RGBA
+
+    def switch_to(self):
+        """Makes context current on calling thread."""
+        if self.backend == 'egl':
+            if not self._egl.eglMakeCurrent(self._display, self._surface, self._surface, self._context):
+                raise RuntimeError("Can't make EGL context current (error 0x{:x}).".format(self._egl.eglGetError()))
+        else:
+            if not self._osmesa.OSMesaMakeCurrent(self._context, self._buffer, GL_UNSIGNED_BYTE, 1, 1):
+                raise RuntimeError("Can't make OSMesa context current.")
+        self._set_pyglet_current()
+
+    def release(self):
+        """Destroys context. It can't be used afterwards."""
+        if self._context is None:
+            return
+        if self.backend == 'egl':
+            self._egl.eglMakeCurrent(self._display, None, None, None)
+            self._egl.eglDestroyContext(self._display, self._context)
+            self._egl.eglDestroySurface(self._display, self._surface)
+            self._egl.eglTerminate(self._display)
+        else:
+            self._osmesa.OSMesaDestroyContext(self._context)
+        self._context = None
+
+    def _set_pyglet_current(self):
+        """Tells pyglet this context is current, so its textures, vertex lists
+        and labels are created and deleted in it."""
+        if self._pyglet_context is None:
+            from pyglet.gl import base
+            self._pyglet_context = base.Context(None)
+            self._pyglet_context.canvas = self # Context isn't attached to a window
+        self._pyglet_context.set_current()
+
+def _load_library(name):
+    path = ctypes.util.find_library(name)
+    if path is None:
+        raise RuntimeError("{} library wasn't found.".format(name))
+    return ctypes.CDLL(path)
+
+def _attrib_list(*values):
+    values = values + (EGL_NONE,)
+    return (ctypes.c_int32 * len(values))(*values)
+
+def _get_egl_device_display(egl, device):
+    """Returns EGL display of device with passed index (EGL_EXT_device_enumeration)."""
+    query_devices = ctypes.CFUNCTYPE(ctypes.c_uint, ctypes.c_int32,
+        ctypes.POINTER(ctypes.c_void_p), ctypes.POINTER(ctypes.c_int32)
+    )(egl.eglGetProcAddress(b'eglQueryDevicesEXT') or 0)
+    get_platform_display = ctypes.CFUNCTYPE(ctypes.c_void_p, ctypes.c_uint,
+        ctypes.c_void_p, ctypes.POINTER(ctypes.c_int32)
+    )(egl.eglGetProcAddress(b'eglGetPlatformDisplayEXT') or 0)
+    if not query_devices or not get_platform_display:
+        raise RuntimeError("EGL doesn't support device enumeration.")
+    devices = (ctypes.c_void_p * 16)()
+    count = ctypes.c_int32(0)
+    query_devices(len(devices), devices, ctypes.byref(count))
+    if not 0 <= device < count.value:
+        raise ValueError("EGL device {} doesn't exist, {} found.".format(device, count.value))
+    return get_platform_display(EGL_PLATFORM_DEVICE_EXT, devices[device], None)
+
+def _load_gl_from(library):
+    """Makes pyglet load OpenGL functions from library instead of libGL."""
+    from pyglet import lib
+    load_library = lib.load_library
+    def load_gl_library(*names, **kwargs):
+        if names and names[0] == 'GL':
+            return library
+        return load_library(*names, **kwargs)
+    lib.load_library = load_gl_library
@@ -0,0 +1,90 @@
+"""Module with view frustum culling helpers.
+"""
+import numpy as np
+from ._lazy import LazyModule
+
+gl = LazyModule('pyglet.gl', globals(), 'gl')
+
+class Frustum:
+    """View frustum given by planes of a view-projection matrix.
+
+    Works for both perspective and orthogonal projections.
+
+    Args:
+        matrix: 4x4 numpy matrix transforming world coordinates into clip
+            coordinates (projection multiplied by view), column vector convention.
+    """
+    # http://www.cs.otago.ac.nz/postgrads/alexis/planeExtraction.pdf
+    def __init__(self, matrix):
+        m = np.asarray(matrix, dtype=np.float64)
+        self.planes = np.array([
+            m[3] + m[0], m[3] - m[0], # Left, right
+            m[3] + m[1], m[3] - m[1], # Bottom, top
+            m[3] + m[2], m[3] - m[2], # Near, far
+        ])
+
+    @classmethod
+    def from_gl(cls):
+        """Returns frustum of currently loaded projection and modelview matrices.
+
+        Note: Modelview matrix is expected to hold only the view transformation,
+            as it's when drawables are drawn.
+        """
+        return cls(get_gl_matrix(gl.GL_PROJECTION_MATRIX) @ get_gl_matrix(gl.GL_MODELVIEW_MATRIX))
+
+    @classmethod
+    def from_camera(cls, camera, env, flip_vertically = False):
+        """Returns frustum of CameraSettings without querying OpenGL state."""
+        return cls(camera.projection_matrix() @ camera.view_matrix(env, flip_vertically))
+
+    def intersects_boxes(self, mins, maxs):
+        """Returns bool array telling which axis-aligned boxes are at least
+        partially inside frustum.
+
+        Args:
+            mins, maxs: N x 3 arrays of boxes' minimal and maximal corners.
+        """
+        normals = self.planes[:, :3]
+        # Corner of each box farthest along each plane's normal: N x 6 x 3
+        corners = np.where(normals >= 0, maxs[:, None, :], mins[:, None, :])
+        dists = np.einsum('npk,pk->np', corners, normals) + self.planes[:, 3]
+        return np.all(dists >= 0, axis=1)
+
+def get_gl_matrix(name):
+    """Returns OpenGL matrix (e.g. GL_PROJECTION_MATRIX) as 4x4 numpy array."""
+    values = (gl.GLfloat * 16)()
+    gl.glGetFloatv(name, values)
+    # OpenGL stores matrices in column-major order
+    return np.array(values, dtype=np.float64).reshape(4, 4).T
+
+class ObjectGrid:
+    """Spatial grid index of objects by their position on the ground.
+
+    Args:
+        objects: Objects with pos attribute.
+        cell_size (float): Size of grid cell.
+        margin (float): Distance objects may extend beyond their cell.
+        height (float): Height objects may extend to.
+    """
+    def __init__(self, objects, cell_size, margin, height):
+        self.cell_size = cell_size
+        pos = np.array([obj.pos for obj in objects], dtype=np.float64).reshape(-1, 3)
+        cells = np.floor(pos[:, [0, 2]] / cell_size).astype(int)
+        self.cells = {}
+        for index, cell in enumerate(map(tuple, cells)):
+            self.cells.setdefault(cell, []).append(index)
+
+        keys = np.array(list(self.cells.keys()), dtype=np.float64).reshape(-1, 2)
+        self.keys = list(self.cells.keys())
+        self.mins = np.stack([keys[:, 0] * cell_size - margin,
+            np.zeros(len(keys)), keys[:, 1] * cell_size - margin], axis=1)
+        self.maxs = np.stack([(keys[:, 0] + 1) * cell_size + margin,
+            np.full(len(keys), height), (keys[:, 1] + 1) * cell_size + margin], axis=1)
+
+    def query(self, frustum):
+        """Returns indices of objects in cells intersecting frustum."""
+        visible = frustum.intersects_boxes(self.mins, self.maxs)
+        indices = []
+        for i in np.flatnonzero(visible):
+            indices += self.cells[self.keys[i]]
+        return indices
@@ -1,10 +1,13 @@
 """Module with drawable class and subclasses.
 """
-import pyglet
-from pyglet import gl
-from gym_duckietown.graphics import bezier_draw
-from gym_duckietown.simulator import get_agent_corners, get_dir_vec
+import weakref
 import numpy as np
+from ._lazy import LazyModule
+from .culling import Frustum, ObjectGrid
+
+pyglet = LazyModule('pyglet', globals(), 'pyglet')
+gl = LazyModule('pyglet.gl', globals(), 'gl')
+simulator = LazyModule('gym_duckietown.simulator', globals(), 'simulator')
 
 class Drawable:
     """Base class for drawable objects."""
@@ -19,10 +22,31 @@ class Drawable:
         raise NotImplementedError("Method is not implemented")
 
 class Tiles(Drawable):
-    """Class that draws all tiles in environment."""
+    """Class that draws all tiles in environment.
 
-    def __init__(self):
-        pass
+    Tiles geometry is built once per map into vertex lists per texture and
+    square chunk of tiles, so each texture is bound once per draw and chunks
+    outside of the view can be skipped. Lane curves are built into a single
+    vertex list. Geometry is kept for each environment drawn, so one Tiles
+    object can be shared by subframes of different environments. Call
+    invalidate if the map is changed in place.
+
+    Args:
+        cull (bool): Should chunks outside of view frustum be skipped or not.
+        chunk_size (int): Number of tiles along each side of a chunk.
+    """
+    CURVE_POINTS = 20 # Points per drawn Bezier curve
+
+    def __init__(self, cull = True, chunk_size = 8):
+        assert chunk_size > 0
+        self.cull = cull
+        self.chunk_size = chunk_size
+        self._caches = weakref.WeakKeyDictionary() # Environment -> _TilesCache
+
+    def invalidate(self):
+        """Forces tiles geometry to be rebuilt on next draw."""
+        for cache in self._caches.values():
+            cache.map_key = None
 
     def draw(self, env):
         """
@@ -31,60 +55,197 @@ class Tiles(Drawable):
         Args:
             env: environment.
         """
+        cache = self._caches.get(env)
+        if cache is None:
+            cache = self._caches[env] = _TilesCache()
+            # Vertex lists of environment which no longer exists are freed
+            weakref.finalize(env, cache.delete)
+        key = self._get_map_key(env, cache)
+        if key != cache.map_key:
+            self._build(env, cache)
+            cache.curves_built = False # Built on demand, when curves are drawn
+            cache.map_key = key
+
+        visible = None
+        if self.cull:
+            visible = Frustum.from_gl().intersects_boxes(cache.chunk_mins, cache.chunk_maxs)
+
         gl.glEnable(gl.GL_TEXTURE_2D)
+        for texture, chunks in cache.batches:
+            bound = False
+            for chunk, vlist in chunks:
+                if visible is not None and not visible[chunk]:
+                    continue
+                if not bound:
+                    texture.bind()
+                    bound = True
+                vlist.draw(gl.GL_QUADS)
+        gl.glColor3f(1, 1, 1)
+
+        if env.draw_curve:
+            self._draw_curves(env, cache)
+
+    def _get_map_key(self, env, cache):
+        """Returns value that changes when tiles of environment change."""
+        # Domain randomization changes tiles' colors and textures on reset
+        if env.domain_rand and cache.last_step is not None and env.step_count < cache.last_step:
+            cache.map_key = None
+        cache.last_step = env.step_count
+        return (id(env.grid), env.grid_width, env.grid_height)
+
+    def _build(self, env, cache):
+        """Builds vertex lists of all tiles grouped by texture and chunk."""
+        cache.delete_batches()
+
+        # Bounding boxes of chunks, chunk index is cx + cz * chunks_x
+        chunks_x = -(-env.grid_width // self.chunk_size)
+        chunks_z = -(-env.grid_height // self.chunk_size)
+        cx, cz = np.meshgrid(np.arange(chunks_x), np.arange(chunks_z))
+        corners = np.stack([cx.ravel(), np.zeros(cx.size), cz.ravel()], axis=1)
+        chunk_len = self.chunk_size * env.road_tile_size
+        cache.chunk_mins = corners * chunk_len - [0, 0.01, 0]
+        cache.chunk_maxs = (corners + [1, 0, 1]) * chunk_len + [0, 0.01, 0]
+
+        groups = {}
         for j in range(env.grid_height):
             for i in range(env.grid_width):
-                # Get the tile type and angle
                 tile = env._get_tile(i, j)
-
                 if tile is None:
                     continue
-
-                # kind = tile['kind']
-                angle = tile['angle']
-                color = tile['color']
                 texture = tile['texture']
-
-                gl.glColor3f(*color)
-
-                gl.glPushMatrix()
-                gl.glTranslatef((i + 0.5) * env.road_tile_size, 0, (j + 0.5) * env.road_tile_size)
-                gl.glRotatef(angle * 90, 0, 1, 0)
-
-                # Bind the appropriate texture
-                texture.bind()
-
-                env.road_vlist.draw(gl.GL_QUADS)
-                gl.glPopMatrix()
-
-                if env.draw_curve and tile['drivable']:
-                    # Find curve with largest dotproduct with heading
-                    curves = env._get_tile(i, j)['curves']
-                    curve_headings = curves[:, -1, :] - curves[:, 0, :]
-                    curve_headings = curve_headings / np.linalg.norm(curve_headings).reshape(1, -1)
-                    dirVec = get_dir_vec(angle)
-                    dot_prods = np.dot(curve_headings, dirVec)
-
-                    # Current ("closest") curve drawn in Red
-                    pts = curves[np.argmax(dot_prods)]
-                    bezier_draw(pts, n=20, red=True)
-
-                    pts = env._get_curve(i, j)
-                    for idx, pt in enumerate(pts):
-                        # Don't draw current curve in blue
-                        if idx == np.argmax(dot_prods):
-                            continue
-                        bezier_draw(pt, n=20)
+                _, tiles = groups.setdefault(id(texture), (texture, []))
+                tiles.append((i, j, tile['angle'], *tile['color']))
+
+        quad = np.array(env.road_vlist.vertices, dtype=np.float32).reshape(-1, 3)
+        tex_coords = list(env.road_vlist.tex_coords)
+        count = len(quad)
+        for texture, tiles in groups.values():
+            tiles = np.array(tiles, dtype=np.float32)
+            chunk_ids = (tiles[:, 0] // self.chunk_size).astype(int) \
+                + (tiles[:, 1] // self.chunk_size).astype(int) * chunks_x
+            # Same transformation as glTranslatef and glRotatef around y axis
+            angles = (tiles[:, 2] * np.pi / 2).reshape(-1, 1)
+            cos, sin = np.cos(angles), np.sin(angles)
+            verts = np.empty((len(tiles), count, 3), dtype=np.float32)
+            verts[:, :, 0] = cos * quad[:, 0] + sin * quad[:, 2] \
+                + ((tiles[:, 0:1] + 0.5) * env.road_tile_size)
+            verts[:, :, 1] = quad[:, 1]
+            verts[:, :, 2] = -sin * quad[:, 0] + cos * quad[:, 2] \
+                + ((tiles[:, 1:2] + 0.5) * env.road_tile_size)
+            colors = tiles[:, 3:6]
+
+            chunks = []
+            for chunk in np.unique(chunk_ids):
+                mask = chunk_ids == chunk
+                n = int(mask.sum())
+                vlist = pyglet.graphics.vertex_list(n * count,
+                    ('v3f/static', verts[mask].ravel().tolist()),
+                    ('t2f/static', tex_coords * n),
+                    ('c3f/static', np.repeat(colors[mask], count, axis=0).ravel().tolist())
+                )
+                chunks.append((int(chunk), vlist))
+            cache.batches.append((texture, chunks))
+
+    def _build_curves(self, env, cache):
+        """Builds vertex list of Bezier lane curves of all drivable tiles."""
+        cache.delete_curves()
+
+        curves = []
+        angles = []
+        for j in range(env.grid_height):
+            for i in range(env.grid_width):
+                tile = env._get_tile(i, j)
+                if tile is None or not tile['drivable'] or len(tile['curves']) == 0:
+                    continue
+                curves.append(tile['curves'])
+                angles.append(tile['angle'])
+        if not curves:
+            return
+        counts = [len(c) for c in curves]
+        tile_ids = np.repeat(np.arange(len(curves)), counts)
+        starts = np.cumsum([0] + counts[:-1])
+        curves = np.concatenate(curves).astype(np.float32) # Control points, M x 4 x 3
+
+        # Current ("closest") curve of a tile has largest dotproduct with its heading
+        angles = np.array(angles, dtype=np.float32)[tile_ids]
+        dir_vecs = np.stack([np.cos(angles), np.zeros_like(angles), -np.sin(angles)], axis=1)
+        dot_prods = np.einsum('ij,ij->i', curves[:, -1, :] - curves[:, 0, :], dir_vecs)
+        is_max = dot_prods == np.maximum.reduceat(dot_prods, starts)[tile_ids]
+        current = np.full(len(counts), -1)
+        max_ids = np.flatnonzero(is_max)[::-1]
+        current[tile_ids[max_ids]] = max_ids # First maximum of each tile wins
+        is_current = np.zeros(len(curves), dtype=bool)
+        is_current[current] = True
+
+        # Cubic Bezier polylines with CURVE_POINTS points, split into GL_LINES segments
+        t = np.linspace(0, 1, self.CURVE_POINTS, dtype=np.float32).reshape(-1, 1)
+        basis = np.hstack([(1 - t) ** 3, 3 * (1 - t) ** 2 * t, 3 * (1 - t) * t ** 2, t ** 3])
+        pts = np.einsum('nk,mkd->mnd', basis, curves)
+        segments = np.stack([pts[:, :-1], pts[:, 1:]], axis=2) # M x (n - 1) x 2 x 3
+
+        # Current curve drawn in red, others in blue
+        colors = np.where(is_current.reshape(-1, 1), [1, 0, 0], [0, 0, 1]).astype(np.float32)
+        colors = np.repeat(colors, 2 * (self.CURVE_POINTS - 1), axis=0)
+
+        n = segments.size // 3
+        cache.curves_vlist = pyglet.graphics.vertex_list(n,
+            ('v3f/static', segments.ravel().tolist()),
+            ('c3f/static', colors.ravel().tolist())
+        )
+
+    def _draw_curves(self, env, cache):
+        """Draws lane curves of drivable tiles."""
+        if not cache.curves_built:
+            self._build_curves(env, cache)
+            cache.curves_built = True
+        if cache.curves_vlist:
+            gl.glDisable(gl.GL_TEXTURE_2D)
+            cache.curves_vlist.draw(gl.GL_LINES)
+            gl.glColor3f(1, 1, 1)
+
+class _TilesCache:
+    """Tiles geometry built for one environment."""
+    def __init__(self):
+        self.map_key = None
+        self.last_step = None
+        self.batches = [] # (texture, list of (chunk, vertex list)) pairs
+        self.chunk_mins = self.chunk_maxs = None
+        self.curves_vlist = None
+        self.curves_built = False
+
+    def delete_batches(self):
+        for _, chunks in self.batches:
+            for _, vlist in chunks:
+                vlist.delete()
+        self.batches = []
+
+    def delete_curves(self):
+        if self.curves_vlist:
+            self.curves_vlist.delete()
+            self.curves_vlist = None
+
+    def delete(self):
+        self.delete_batches()
+        self.delete_curves()
 
 class Objects(Drawable):
-    """Draws all tiles in environment.
+    """Draws all objects in environment.
+
+    Static objects are indexed by a grid built once per map of each environment
+    drawn, so objects in cells outside of view frustum are skipped. Other
+    objects are always drawn.
 
     Args:
         draw_bbox (bool): should be bbox for each object to be drawn or not.
+        cull (bool): Should static objects outside of view frustum be skipped or not.
     """
+    MAX_OBJECT_HEIGHT = 1.0 # Height of culled boxes
+    MAX_OBJECT_RADIUS = 0.5 # Distance objects may extend beyond their grid cell
 
-    def __init__(self, draw_bbox = False):
+    def __init__(self, draw_bbox = False, cull = True):
         self.draw_bbox = draw_bbox
+        self.cull = cull
+        self._caches = weakref.WeakKeyDictionary() # Environment -> (key, static, dynamic, grid)
 
     def draw(self, env):
         """
@@ -93,9 +254,30 @@ class Objects(Drawable):
         Args:
             env: environment.
         """
-        for obj in env.objects:
+        if not self.cull:
+            for obj in env.objects:
+                obj.render(self.draw_bbox)
+            return
+
+        key = (id(env.objects), len(env.objects))
+        cache = self._caches.get(env)
+        if cache is None or cache[0] != key:
+            cache = self._caches[env] = (key, *self._build(env))
+        _, static, dynamic, grid = cache
+
+        for index in grid.query(Frustum.from_gl()):
+            static[index].render(self.draw_bbox)
+        for obj in dynamic:
             obj.render(self.draw_bbox)
 
+    def _build(self, env):
+        """Returns static objects, other objects and grid index of static objects."""
+        static = [obj for obj in env.objects if getattr(obj, 'static', False)]
+        dynamic = [obj for obj in env.objects if not getattr(obj, 'static', False)]
+        grid = ObjectGrid(static, env.road_tile_size,
+            self.MAX_OBJECT_RADIUS, self.MAX_OBJECT_HEIGHT)
+        return static, dynamic, grid
+
 class Bot(Drawable):
     """Draws bot in environment.
 
@@ -125,12 +307,10 @@ class Bot(Drawable):
         gl.glRotatef(env.cur_angle * 180 / np.pi, 0, 1, 0)
         env.mesh.render()
         gl.glPopMatrix()
-        label = pyglet.text.Label("Test", x=20, y=20)
-        label.draw()
 
     def _draw_bbox(self, env):
         """Auxiliary draw method for bot's bbox."""
-        corners = get_agent_corners(env.cur_pos, env.cur_angle)
+        corners = simulator.get_agent_corners(env.cur_pos, env.cur_angle)
         gl.glColor3f(1, 0, 0)
         gl.glBegin(gl.GL_LINE_LOOP)
         gl.glVertex3f(corners[0, 0], 0.01, corners[0, 1])
@@ -172,6 +352,29 @@ class Text(Drawable):
         self.info = info
         self.label = None
         self.kwargs = kwargs
+        self.string = None
+
+    def update(self, env):
+        """Updates label's text. Layout isn't done when string didn't change.
+
+        Args:
+            env: environment
+        """
+        self.label, self.string = self.update_label(self.label, self.string)
+
+    def update_label(self, label, string, batch = None):
+        """Returns label showing current string of info and the string.
+
+        Label is created if None passed, otherwise its text is set only when
+        string differs from the passed previous one.
+        """
+        new_string = self.info.get_str()
+        if label is None:
+            label = pyglet.text.Label(new_string, x=self.x, y=self.y,
+                batch=batch, **self.kwargs)
+        elif new_string != string:
+            label.text = new_string
+        return label, new_string
 
     def draw(self, env):
         """Draw text on active framebuffer.
@@ -179,23 +382,183 @@ class Text(Drawable):
         Args:
             env: environment
         """
-        string = self.info.get_str()
-        if self.label:
-            self.label.text = string
-        else:
-            self.label = pyglet.text.Label(string, x=self.x, y=self.y, **self.kwargs)
+        self.update(env)
         self.label.draw()
 
-# TODO
+class TextBatch(Drawable):
+    """Draws several Text drawables in one batch.
+
+    Args:
+        texts: List of Text objects. Batch has its own labels of them, so the same
+            Text can be drawn by several subframes.
+    """
+
+    def __init__(self, texts):
+        self.batch = pyglet.graphics.Batch()
+        self.texts = list(texts)
+        self.labels = [None] * len(self.texts)
+        self.strings = [None] * len(self.texts)
+
+    def draw(self, env):
+        """Updates all texts and draws them with one call.
+
+        Args:
+            env: environment
+        """
+        for i, text in enumerate(self.texts):
+            self.labels[i], self.strings[i] = text.update_label(
+                self.labels[i], self.strings[i], self.batch)
+        self.batch.draw()
+
+def batch_texts(drawers):
+    """Returns list of drawers where all Text objects are replaced by one TextBatch.
+
+    TextBatch takes place of the first Text in the list.
+    """
+    texts = [drawer for drawer in drawers if isinstance(drawer, Text)]
+    if len(texts) < 2:
+        return list(drawers)
+    batched = []
+    for drawer in drawers:
+        if drawer is texts[0]:
+            batched.append(TextBatch(texts))
+        elif not isinstance(drawer, Text):
+            batched.append(drawer)
+    return batched
+
 class Path(Drawable):
-    # TODO
-    def __init__(self):
-        self.points = []
-        pass
+    """Draws trajectory of bot as a line.
+
+    Latest positions are kept in a ring buffer at full resolution. Positions
+    evicted from it are moved to history buffer, which is decimated (every
+    second point is dropped) whenever it's full. So memory and draw cost are
+    bounded no matter how long the episode is.
+
+    Args:
+        recent (int): Number of latest positions kept at full resolution.
+        history (int): Number of older positions kept.
+        teleport_dist (float): Distance between consecutive positions at which
+            trajectory is broken instead of being connected by a line.
+        color (tuple): Color of trajectory.
+        height (float): Height of trajectory above the ground.
+
+    Note: Position is recorded when step count of environment changes. Path is
+        also broken when episode is reset.
+    """
+
+    def __init__(self, recent = 4096, history = 4096, teleport_dist = 0.5,
+        color = (1, 0.5, 0), height = 0.01
+    ):
+        assert recent > 0 and history > 1
+        self.teleport_dist = teleport_dist
+        self.color = color
+        self.height = height
+        self._recent = np.empty((recent, 3), dtype=np.float32)
+        self._recent_breaks = np.empty(recent, dtype=bool)
+        self._history = np.empty((history, 3), dtype=np.float32)
+        self._history_breaks = np.empty(history, dtype=bool)
+        self.clear()
+
+    def clear(self):
+        """Removes all recorded positions."""
+        self._recent_start = self._recent_len = 0
+        self._history_len = 0
+        self._stride = 1 # History keeps each stride-th evicted position
+        self._skipped = 0 # Evicted positions skipped since last kept one
+        self._skipped_break = False # Whether any skipped position breaks path
+        self._last_step = None
+
+    def record(self, env):
+        """Records bot's position if it's a new step of environment.
+
+        Args:
+            env: environment.
+        """
+        step = env.step_count
+        if step == self._last_step:
+            return
+        pos = np.array(env.cur_pos, dtype=np.float32)
+        brk = self._last_step is None or step < self._last_step
+        if not brk and self._recent_len > 0:
+            last = self._recent[(self._recent_start + self._recent_len - 1) % len(self._recent)]
+            brk = np.linalg.norm(pos - last) > self.teleport_dist
+        self._last_step = step
+
+        capacity = len(self._recent)
+        if self._recent_len == capacity:
+            i = self._recent_start
+            self._push_history(self._recent[i].copy(), self._recent_breaks[i])
+            self._recent_start = (i + 1) % capacity
+        else:
+            self._recent_len += 1
+        i = (self._recent_start + self._recent_len - 1) % capacity
+        self._recent[i] = pos
+        self._recent_breaks[i] = brk
+
+    def _push_history(self, pos, brk):
+        self._skipped_break |= brk
+        self._skipped += 1
+        if self._skipped < self._stride:
+            return
+        if self._history_len == len(self._history):
+            self._decimate()
+        i = self._history_len
+        self._history[i] = pos
+        self._history_breaks[i] = self._skipped_break
+        self._history_len += 1
+        self._skipped = 0
+        self._skipped_break = False
+
+    def _decimate(self):
+        """Drops every second position from history."""
+        n = self._history_len
+        breaks = self._history_breaks[:n]
+        kept = (n + 1) // 2
+        kept_breaks = breaks[0::2].copy()
+        # Segment over dropped position is broken if any of its parts was
+        kept_breaks[1:] |= breaks[1::2][:kept - 1]
+        # Last position is dropped when their number is even, its break moves
+        #   to the next position kept
+        if n % 2 == 0:
+            self._skipped_break |= breaks[n - 1]
+        self._history[:kept] = self._history[:n:2]
+        self._history_breaks[:kept] = kept_breaks
+        self._history_len = kept
+        self._stride *= 2
+
+    def get_points(self):
+        """Returns kept positions (N x 3) from the oldest and array of N flags
+        whether path is broken between previous position and each of them.
+        """
+        start, n = self._recent_start, self._recent_len
+        order = (np.arange(n) + start) % len(self._recent)
+        pts = np.concatenate([self._history[:self._history_len], self._recent[order]])
+        breaks = np.concatenate([self._history_breaks[:self._history_len], self._recent_breaks[order]])
+        if self._history_len > 0 and n > 0:
+            breaks[self._history_len] |= self._skipped_break
+        return pts, breaks
 
     def draw(self, env):
-        # Move, (x, y)
-        # Teleport, (x, y)
-        # history =
+        """Records bot's position and draws trajectory.
 
-        raise NotImplementedError("Method is not implemented")
+        Args:
+            env: environment.
+        """
+        self.record(env)
+
+        pts, breaks = self.get_points()
+        if len(pts) < 2:
+            return
+
+        # Pairs of connected consecutive positions as GL_LINES
+        connected = ~breaks[1:]
+        segments = np.stack([pts[:-1][connected], pts[1:][connected]], axis=1)
+        if len(segments) == 0:
+            return
+        segments[:, :, 1] = self.height
+
+        gl.glDisable(gl.GL_TEXTURE_2D)
+        gl.glColor3f(*self.color)
+        pyglet.graphics.draw(segments.size // 3, gl.GL_LINES,
+            ('v3f', segments.ravel().tolist()))
+        gl.glColor3f(1, 1, 1)
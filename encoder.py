@@ -0,0 +1,94 @@
+"""Module with background frame encoder.
+"""
+from collections import deque
+import threading
+
+class FrameEncoder:
+    """Writes frames on a worker thread, so the caller doesn't wait for encoding.
+
+    Frames are passed to the worker through a bounded queue. What happens when
+    the queue is full is decided by the backpressure policy.
+
+    Args:
+        write: Callable invoked on worker thread for each frame.
+        queue_size: Maximal number of frames waiting to be written.
+        backpressure(block/drop-oldest/drop-newest): Policy used when queue is full.
+            'block' waits for free place, 'drop-oldest' discards the oldest queued
+            frame, 'drop-newest' discards the frame being put.
+    """
+    def __init__(self, write, queue_size = 32, backpressure = 'block'):
+        if backpressure not in ('block', 'drop-oldest', 'drop-newest'):
+            raise ValueError("Backpressure parameter is invalid.")
+        assert queue_size > 0
+        self.write = write
+        self.queue_size = queue_size
+        self.backpressure = backpressure
+        self.dropped = 0
+        self.written = 0
+        self.error = None
+
+        self._queue = deque()
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="FrameEncoder", daemon=True)
+        self._thread.start()
+
+    def put(self, frame):
+        """Queues frame for writing.
+
+        Returns:
+            Frame that was dropped because of backpressure or None.
+        """
+        with self._cond:
+            assert not self._closed
+            if self.error:
+                raise RuntimeError("Frame encoder failed.") from self.error
+            dropped = None
+            if len(self._queue) >= self.queue_size:
+                if self.backpressure == 'block':
+                    while len(self._queue) >= self.queue_size and not self.error:
+                        self._cond.wait()
+                    if self.error:
+                        raise RuntimeError("Frame encoder failed.") from self.error
+                elif self.backpressure == 'drop-oldest':
+                    dropped = self._queue.popleft()
+                    self.dropped += 1
+                else:
+                    self.dropped += 1
+                    return frame
+            self._queue.append(frame)
+            self._cond.notify_all()
+            return dropped
+
+    def close(self):
+        """Writes all queued frames and stops worker thread.
+
+        Returns:
+            Number of frames dropped because of backpressure.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        if self.error:
+            raise RuntimeError("Frame encoder failed.") from self.error
+        return self.dropped
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                frame = self._queue.popleft()
+                self._cond.notify_all()
+            try:
+                self.write(frame)
+                self.written += 1
+            except Exception as e:
+                with self._cond:
+                    self.error = e
+                    self._queue.clear()
+                    self._cond.notify_all()
+                return
@@ -1,6 +1,17 @@
-from ctypes import byref # , POINTER
-import pyglet
-from pyglet import gl
+from collections import deque
+from ctypes import byref, memmove # , POINTER
+import weakref
+from ._lazy import LazyModule
+
+pyglet = LazyModule('pyglet', globals(), 'pyglet')
+gl = LazyModule('pyglet.gl', globals(), 'gl')
+
+# Color formats: name -> names of (internal format, format, type) GL constants
+FORMATS = {
+    'rgba32f': ('GL_RGBA32F', 'GL_RGBA', 'GL_FLOAT'),
+    'rgba8':   ('GL_RGBA8', 'GL_RGBA', 'GL_UNSIGNED_BYTE'),
+    'rgb8':    ('GL_RGB8', 'GL_RGB', 'GL_UNSIGNED_BYTE'),
+}
 
 class Framebuffer:
     """OpenGL Framebuffer wrapper class.
@@ -8,61 +19,314 @@ class Framebuffer:
     Args:
         width:  Width of the framebuffer.
         height: Height of the framebuffer.
-        context: (optional) OpenGL context to switch to when creating and using Framebuffer.
-            If none passed - context is not switched by this class.
+        context: (optional) OpenGL context to switch to when creating and using Framebuffer,
+            e.g. pyglet window or context.HeadlessContext. If none passed - context
+            is not switched by this class.
+        format(rgba32f/rgba8/rgb8): Format of color buffer.
+        samples: Number of samples per pixel. If more than 0, color and depth are
+            stored in multisample renderbuffers and resolved when blitting.
+
+    Note: GL objects are deleted by release, which can also be done by using
+        Framebuffer as a context manager.
     """
     # http://www.opengl-tutorial.org/ru/intermediate-tutorials/tutorial-14-render-to-texture/
     # http://www.songho.ca/opengl/gl_fbo.html
-    def __init__(self, width, height, context=None):
+    def __init__(self, width, height, context=None, format='rgba8', samples=0):
+        if format not in FORMATS:
+            raise ValueError("Format parameter is invalid.")
         if context:
             context.switch_to()
         self.context = context
-        # global recorder_context
-        # assert recorder_context or env
-        # if not recorder_context:
-        #     # recorder_context = pyglet.window.Window(width=1, height=1, visible=False)
-        #     recorder_context = env.shadow_window
-        # recorder_context.switch_to()
+        self.format = format
+        self.samples = samples
+        internal_format, pixel_format, pixel_type = [getattr(gl, name) for name in FORMATS[format]]
 
         id = gl.GLuint(0)
         # Generate framebuffer
         gl.glGenFramebuffers(1, byref(id))
         gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, id)
-        # width = 80
-        # height = 60
         self.fb_id = id
         self.width = width
         self.height = height
 
-        # Generate texture for color buffer
-        colorbuffer = gl.GLuint(0)
-        gl.glGenTextures(1, byref(colorbuffer))
-        gl.glBindTexture(gl.GL_TEXTURE_2D, colorbuffer)
-        gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_RGBA, width, height, 0, gl.GL_RGBA, gl.GL_FLOAT, None)
-        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_NEAREST)
-        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_NEAREST)
-        self.colorbuffer_id = colorbuffer
+        if samples > 0:
+            # Generate multisample renderbuffer for color buffer
+            colorbuffer = gl.GLuint(0)
+            gl.glGenRenderbuffers(1, byref(colorbuffer))
+            gl.glBindRenderbuffer(gl.GL_RENDERBUFFER, colorbuffer)
+            gl.glRenderbufferStorageMultisample(gl.GL_RENDERBUFFER, samples, internal_format, width, height)
+            gl.glFramebufferRenderbuffer(gl.GL_FRAMEBUFFER, gl.GL_COLOR_ATTACHMENT0,
+                gl.GL_RENDERBUFFER, colorbuffer)
+            self.colorbuffer_id = None
+            self.color_renderbuffer_id = colorbuffer
+        else:
+            # Generate texture for color buffer
+            colorbuffer = gl.GLuint(0)
+            gl.glGenTextures(1, byref(colorbuffer))
+            gl.glBindTexture(gl.GL_TEXTURE_2D, colorbuffer)
+            gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, internal_format, width, height, 0, pixel_format, pixel_type, None)
+            gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_NEAREST)
+            gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_NEAREST)
+            gl.glFramebufferTexture2D(gl.GL_FRAMEBUFFER, gl.GL_COLOR_ATTACHMENT0,
+                gl.GL_TEXTURE_2D, colorbuffer, 0)
+            self.colorbuffer_id = colorbuffer
+            self.color_renderbuffer_id = None
 
         # Generate depth buffer
         depthbuffer = gl.GLuint(0)
         gl.glGenRenderbuffers(1, byref(depthbuffer))
         gl.glBindRenderbuffer(gl.GL_RENDERBUFFER, depthbuffer)
-        gl.glRenderbufferStorage(gl.GL_RENDERBUFFER, gl.GL_DEPTH_COMPONENT, width, height)
-        self.depthbuffer_id = depthbuffer
-
-        # Set texture and depth buffer to the framebuffer
-        gl.glFramebufferTexture2D(gl.GL_FRAMEBUFFER, gl.GL_COLOR_ATTACHMENT0,
-            gl.GL_TEXTURE_2D, colorbuffer, 0)
+        if samples > 0:
+            gl.glRenderbufferStorageMultisample(gl.GL_RENDERBUFFER, samples,
+                gl.GL_DEPTH_COMPONENT24, width, height)
+        else:
+            gl.glRenderbufferStorage(gl.GL_RENDERBUFFER, gl.GL_DEPTH_COMPONENT24, width, height)
         gl.glFramebufferRenderbuffer(gl.GL_FRAMEBUFFER, gl.GL_DEPTH_ATTACHMENT, gl.GL_RENDERBUFFER, depthbuffer)
+        self.depthbuffer_id = depthbuffer
 
         if pyglet.options['debug_gl']:
           res = gl.glCheckFramebufferStatus(gl.GL_FRAMEBUFFER)
           assert res == gl.GL_FRAMEBUFFER_COMPLETE
 
         gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, 0)
+        self.pbo_ring = None
+        self._resolve_fb = None # Single sample copy used for flipping multisample buffer
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def release(self):
+        """Deletes GL objects of framebuffer. Framebuffer can't be used afterwards."""
+        if self.fb_id is None:
+            return
+        if self.context:
+            self.context.switch_to()
+        self.release_pbo_ring()
+        if self._resolve_fb:
+            self._resolve_fb.release()
+            self._resolve_fb = None
+        if self.colorbuffer_id is not None:
+            gl.glDeleteTextures(1, byref(self.colorbuffer_id))
+        if self.color_renderbuffer_id is not None:
+            gl.glDeleteRenderbuffers(1, byref(self.color_renderbuffer_id))
+        gl.glDeleteRenderbuffers(1, byref(self.depthbuffer_id))
+        gl.glDeleteFramebuffers(1, byref(self.fb_id))
+        self.fb_id = None
+
+    def release_pbo_ring(self):
+        """Deletes ring of pixel buffer objects if there is one."""
+        if self.pbo_ring:
+            self.pbo_ring.release()
+            self.pbo_ring = None
+
+    def create_pbo_ring(self, size = 2, format = None, channels = 3):
+        """Creates ring of pixel buffer objects used for asynchronous readback.
+
+        Args:
+            size: Number of pixel buffers in the ring.
+            format: OpenGL pixel format used for reading, GL_BGR if none passed.
+            channels: Number of bytes per pixel in passed format.
+        """
+        if self.context:
+            self.context.switch_to()
+        self.pbo_ring = PixelBufferRing(self, size, format, channels)
+        return self.pbo_ring
+
+    def blit(self, target, flip_vertically = False):
+        """Copies color buffer into another framebuffer of the same size on GPU.
+
+        Args:
+            target: Framebuffer to copy into.
+            flip_vertically: Should image be flipped vertically while copying or not.
+                Flipped image has rows in top to bottom order as used by OpenCV.
+        """
+        assert self.width == target.width and self.height == target.height
+        if self.samples > 0 and (flip_vertically or target.samples > 0):
+            # Multisample buffer can be blitted only into the same rectangle of
+            #   a single sample buffer, so it's resolved first
+            if not self._resolve_fb:
+                self._resolve_fb = Framebuffer(self.width, self.height, format=self.format)
+            self.blit(self._resolve_fb)
+            self._resolve_fb.blit(target, flip_vertically)
+            return
+        gl.glBindFramebuffer(gl.GL_READ_FRAMEBUFFER, self.fb_id)
+        gl.glBindFramebuffer(gl.GL_DRAW_FRAMEBUFFER, target.fb_id)
+        if flip_vertically:
+            dst = (0, self.height, self.width, 0)
+        else:
+            dst = (0, 0, self.width, self.height)
+        gl.glBlitFramebuffer(0, 0, self.width, self.height, *dst,
+            gl.GL_COLOR_BUFFER_BIT, gl.GL_NEAREST)
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, target.fb_id)
+
+    def blit_to_rect(self, target, x, y, width, height, filter = None):
+        """Copies whole color buffer into rectangle of another framebuffer, scaling it.
+
+        Args:
+            target: Framebuffer to copy into. Must not be multisample if size differs.
+            x, y, width, height: Rectangle of target to copy into.
+            filter: GL_LINEAR or GL_NEAREST filter used for scaling, GL_LINEAR if none passed.
+        """
+        if filter is None:
+            filter = gl.GL_LINEAR
+        gl.glBindFramebuffer(gl.GL_READ_FRAMEBUFFER, self.fb_id)
+        gl.glBindFramebuffer(gl.GL_DRAW_FRAMEBUFFER, target.fb_id)
+        gl.glBlitFramebuffer(0, 0, self.width, self.height, x, y, x + width, y + height,
+            gl.GL_COLOR_BUFFER_BIT, filter)
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, target.fb_id)
 
     def use(self):
         if self.context:
             self.context.switch_to()
         gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, self.fb_id)
         gl.glViewport(0, 0, self.width, self.height)
+
+    def clear(self, color = (0, 0, 0, 1)):
+        """Clears color and depth buffers.
+
+        Note: Changes clear color and unbinds framebuffer.
+        """
+        self.use()
+        gl.glClearColor(*color)
+        gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, 0)
+
+
+class PixelBufferRing:
+    """Ring of pixel buffer objects for asynchronous readback of a Framebuffer.
+
+    glReadPixels into a bound pixel pack buffer returns without waiting for the
+    GPU, so frame N can be copied out while frame N+1 is being drawn.
+
+    Args:
+        fb: Framebuffer pixels are read from.
+        size: Number of pixel buffers in the ring.
+        format: OpenGL pixel format used for reading, GL_BGR if none passed.
+        channels: Number of bytes per pixel in passed format.
+    """
+    # http://www.songho.ca/opengl/gl_pbo.html
+    def __init__(self, fb, size = 2, format = None, channels = 3):
+        assert size > 0
+        if format is None:
+            format = gl.GL_BGR
+        self.fb = fb
+        self.size = size
+        self.format = format
+        self.nbytes = fb.width * fb.height * channels
+        self.pending = deque() # Buffers with started but not finished readback
+        self.next = 0
+
+        ids = (gl.GLuint * size)()
+        gl.glGenBuffers(size, ids)
+        self.buffer_ids = list(ids)
+        for id in self.buffer_ids:
+            gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, id)
+            gl.glBufferData(gl.GL_PIXEL_PACK_BUFFER, self.nbytes, None, gl.GL_STREAM_READ)
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, 0)
+
+    def start_read(self):
+        """Starts readback of the bound framebuffer into the next pixel buffer.
+
+        Note: All buffers must not be pending, finish oldest readback first.
+        """
+        assert len(self.pending) < self.size
+        id = self.buffer_ids[self.next]
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, id)
+        gl.glPixelStorei(gl.GL_PACK_ALIGNMENT, 1)
+        gl.glReadPixels(0, 0,
+            self.fb.width, self.fb.height,
+            self.format,
+            gl.GL_UNSIGNED_BYTE,
+            0) # Offset into the bound pixel buffer
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, 0)
+        self.pending.append(id)
+        self.next = (self.next + 1) % self.size
+
+    def finish_read(self, out):
+        """Copies the oldest pending readback into out.
+
+        Args:
+            out: Contiguous numpy array of fb.height x fb.width x channels bytes.
+        """
+        assert out.nbytes == self.nbytes
+        id = self.pending.popleft()
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, id)
+        ptr = gl.glMapBuffer(gl.GL_PIXEL_PACK_BUFFER, gl.GL_READ_ONLY)
+        memmove(out.ctypes.data, ptr, self.nbytes)
+        gl.glUnmapBuffer(gl.GL_PIXEL_PACK_BUFFER)
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, 0)
+        return out
+
+    def release(self):
+        """Deletes pixel buffer objects. Pending readbacks are lost."""
+        ids = (gl.GLuint * self.size)(*self.buffer_ids)
+        gl.glDeleteBuffers(self.size, ids)
+        self.buffer_ids = []
+        self.pending.clear()
+
+class FramebufferPool:
+    """Pool of framebuffers reused by size, format and number of samples.
+
+    Framebuffers are specific to OpenGL context, so they are pooled separately
+    for each context. Pool doesn't keep contexts alive: free framebuffers of a
+    context are dropped when the context is garbage collected, as their GL
+    objects are gone with it.
+
+    Args:
+        max_free (int): Maximal number of free framebuffers kept for each size,
+            format and number of samples. Framebuffers released beyond it are deleted.
+    """
+    def __init__(self, max_free = 2):
+        self.max_free = max_free
+        self._free = {} # id(context) -> (weak reference to context or None, key -> list of framebuffers)
+
+    def acquire(self, width, height, context=None, format='rgba8', samples=0):
+        """Returns cleared free framebuffer with passed parameters, creates new one
+        if there is none.
+
+        See Framebuffer for parameters.
+        """
+        key = (width, height, format, samples)
+        entry = self._free.get(id(context))
+        free = entry[1].get(key) if entry else None
+        if free:
+            fb = free.pop()
+            fb.context = context
+        else:
+            fb = Framebuffer(width, height, context, format, samples)
+        # Pixels of previous user or uninitialized memory
+        fb.clear()
+        return fb
+
+    def release(self, fb):
+        """Returns framebuffer acquired from this pool back to the pool."""
+        fb.release_pbo_ring()
+        context = fb.context
+        entry = self._free.get(id(context))
+        if entry is None:
+            ref = None
+            if context is not None:
+                ref = weakref.ref(context, lambda _, key=id(context): self._free.pop(key, None))
+            entry = self._free[id(context)] = (ref, {})
+        free = entry[1].setdefault((fb.width, fb.height, fb.format, fb.samples), [])
+        if len(free) >= self.max_free:
+            fb.release()
+            return
+        fb.context = None # Set again when acquired
+        free.append(fb)
+
+    def clear(self):
+        """Deletes all free framebuffers."""
+        for ref, frees in self._free.values():
+            context = ref() if ref else None
+            for free in frees.values():
+                for fb in free:
+                    fb.context = context
+                    fb.release()
+        self._free = {}
+
+# Pool shared by recorders by default
+default_pool = FramebufferPool()
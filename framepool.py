@@ -0,0 +1,41 @@
+"""Module with pool of preallocated frame arrays.
+"""
+from collections import deque
+import numpy as np
+
+class FramePool:
+    """Pool of numpy arrays reused between frames.
+
+    Arrays are allocated only when all previously allocated arrays are in use,
+    so steady state recording doesn't allocate memory per frame.
+
+    Args:
+        shape: Shape of each frame array.
+        dtype: Type of frame array elements.
+        prealloc: Number of arrays allocated in constructor.
+
+    Note: acquire and release may be called from different threads.
+    """
+    def __init__(self, shape, dtype = np.uint8, prealloc = 2):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.allocated = 0
+        self._free = deque()
+        for _ in range(prealloc):
+            self._free.append(self._allocate())
+
+    def acquire(self):
+        """Returns free array. Its content is undefined."""
+        try:
+            return self._free.pop()
+        except IndexError:
+            return self._allocate()
+
+    def release(self, frame):
+        """Returns array acquired from this pool back to the pool."""
+        assert frame.shape == self.shape and frame.dtype == self.dtype
+        self._free.append(frame)
+
+    def _allocate(self):
+        self.allocated += 1
+        return np.empty(self.shape, dtype=self.dtype)
@@ -1,7 +1,88 @@
-from gym_duckietown.simulator import NotInLane
 from math import pi
+import weakref
 import numpy as np
 
+class EnvSnapshot:
+    """Quantities derived from environment's state at one step.
+
+    Each quantity is computed at most once, on first access. Returned arrays are
+    shared between all users of the snapshot and are read-only.
+
+    Args:
+        env: Environment to get state from.
+        key: Value identifying state of environment, see get_snapshot.
+    """
+    def __init__(self, env, key):
+        self.env = env
+        self.key = key
+        self._pos = None
+        self._dir = None
+        self._lane_pos = None
+        self._lane_pos_known = False
+
+    @property
+    def step_count(self):
+        return self.env.step_count
+
+    @property
+    def angle(self):
+        return self.env.cur_angle
+
+    @property
+    def speed(self):
+        return self.env.speed
+
+    @property
+    def pos(self):
+        if self._pos is None:
+            self._pos = _readonly(self.env.cur_pos)
+        return self._pos
+
+    @property
+    def dir(self):
+        if self._dir is None:
+            self._dir = _readonly(self.env.get_dir_vec())
+        return self._dir
+
+    @property
+    def lane_pos(self):
+        """Bot's lane position (see env.get_lane_pos2) or None if bot isn't in lane.
+
+        Bot isn't in lane when get_lane_pos2 returns None or raises env.NotInLane
+        (gym_duckietown's NotInLane if environment has no such attribute).
+        """
+        if not self._lane_pos_known:
+            NotInLane = getattr(self.env, 'NotInLane', None)
+            if NotInLane is None:
+                # Imported here, so infos can be used without simulator being loaded
+                from gym_duckietown.simulator import NotInLane
+            try:
+                self._lane_pos = self.env.get_lane_pos2(self.env.cur_pos, self.env.cur_angle)
+            except NotInLane:
+                self._lane_pos = None
+            self._lane_pos_known = True
+        return self._lane_pos
+
+_snapshots = weakref.WeakKeyDictionary()
+
+def get_snapshot(env):
+    """Returns EnvSnapshot of current state of environment.
+
+    Snapshot is shared by all callers until environment's step count or bot's
+    pose changes.
+    """
+    key = (env.step_count, env.cur_angle, *env.cur_pos)
+    snapshot = _snapshots.get(env)
+    if snapshot is None or snapshot.key != key:
+        snapshot = EnvSnapshot(env, key)
+        _snapshots[env] = snapshot
+    return snapshot
+
+def _readonly(values):
+    arr = np.array(values)
+    arr.flags.writeable = False
+    return arr
+
 class Info:
     #TODO comments
     """Base class for objects"""
@@ -22,13 +103,13 @@ class BotPos(Info):
 
     def __call__(self, env = None):
         if env == None:
-            ret = self.env.cur_pos
+            ret = get_snapshot(self.env).pos
         else:
-            ret = env.cur_pos
-        return np.array(ret)
+            ret = get_snapshot(env).pos
+        return ret
 
     def get_str(self):
-        string = self.prefix + str([round(val, 2) for val in self.env.cur_pos])
+        string = self.prefix + str([round(val, 2) for val in self()])
         return string
 
 class BotSpeed(Info):
@@ -106,10 +187,10 @@ class BotDirection(Info):
 
     def __call__(self, env = None):
         if env == None:
-            ret = self.env.get_dir_vec()
+            ret = get_snapshot(self.env).dir
         else:
-            ret = env.get_dir_vec()
-        return np.array(ret)
+            ret = get_snapshot(env).dir
+        return ret
 
     def get_str(self):
         return self.prefix + str([round(val, 2) for val in self()])
@@ -126,19 +207,63 @@ class WorldUp(Info):
     def get_str(self):
         return self.prefix + str(self())
 
-class Distance(Info):
-    #TODO
+class _Accumulator(Info):
+    """Base class for infos accumulating a value over steps of an episode.
+
+    Only state of the current step is read, so each call takes constant time and
+    memory. Accumulated value is reset when env.step_count decreases (episode was
+    reset).
+
+    Note: Should be called on every step, steps between calls are accounted
+        using state of the step of the call.
+    """
     def __init__(self, env, prefix = ""):
         self.env = env
         self.prefix = prefix
-        raise NotImplementedError("Class is not implemented")
+        self.total = 0.0
+        self.last_step = None
 
     def __call__(self, env = None):
-        pass
+        if env == None:
+            t_env = self.env
+        else:
+            t_env = env
+        step = t_env.step_count
+        if self.last_step is None or step < self.last_step:
+            self.total = 0.0
+            self._reset(t_env)
+        elif step > self.last_step:
+            self.total += self._update(t_env, step - self.last_step)
+        self.last_step = step
+        return self.total
 
     def get_str(self):
+        return self.prefix + str(round(self(), 2))
+
+    def _reset(self, env):
+        """Called on the first step of an episode."""
         pass
 
+    def _update(self, env, steps):
+        """Returns value accumulated during passed number of steps."""
+        raise NotImplementedError("Method is not implemented")
+
+class Distance(_Accumulator):
+    """Distance travelled by bot in current episode.
+
+    Args:
+        env: Environment to get info from.
+        prefix (string): Prefix concatenated to stringified value when get_str called.
+    """
+    def _reset(self, env):
+        self.last_pos = get_snapshot(env).pos
+
+    def _update(self, env, steps):
+        pos = get_snapshot(env).pos
+        delta = np.linalg.norm(pos - self.last_pos)
+        self.last_pos = pos
+        return delta
+
 class IsInLane(Info):
     #TODO
     def __init__(self, env, prefix = ""):
@@ -150,37 +275,40 @@ class IsInLane(Info):
             t_env = self.env
         else:
             t_env = env
-        try:
-            t_env.get_lane_pos2(t_env.cur_pos, t_env.cur_angle)
-            return True
-        except NotInLane:
-            return False
+        return get_snapshot(t_env).lane_pos is not None
 
     def get_str(self):
         return self.prefix + str(self())
 
-class TimeOutOfLane(Info):
-    #TODO
-    def __init__(self, env, prefix = ""):
-        self.env = env
-        self.prefix = prefix
-        raise NotImplementedError("Class is not implemented")
+class TimeOutOfLane(_Accumulator):
+    """Time in seconds bot spent out of lane in current episode.
 
-    def __call__(self, env = None):
-        pass
-
-    def get_str(self):
-        pass
-
-class TimeInactive(Info):
-    #TODO
+    Args:
+        env: Environment to get info from.
+        prefix (string): Prefix concatenated to stringified value when get_str called.
+    """
     def __init__(self, env, prefix = ""):
-        self.env = env
-        self.prefix = prefix
-        raise NotImplementedError("Class is not implemented")
+        super(TimeOutOfLane, self).__init__(env, prefix)
+        self.in_lane = IsInLane(env)
 
-    def __call__(self, env = None):
-        pass
+    def _update(self, env, steps):
+        if self.in_lane(env):
+            return 0.0
+        return steps * env.delta_time
 
-    def get_str(self):
-        pass
+class TimeInactive(_Accumulator):
+    """Time in seconds bot spent not moving in current episode.
+
+    Args:
+        env: Environment to get info from.
+        prefix (string): Prefix concatenated to stringified value when get_str called.
+        threshold (float): Bot is inactive when absolute value of its speed is less.
+    """
+    def __init__(self, env, prefix = "", threshold = 1e-3):
+        super(TimeInactive, self).__init__(env, prefix)
+        self.threshold = threshold
+
+    def _update(self, env, steps):
+        if abs(get_snapshot(env).speed) < self.threshold:
+            return steps * env.delta_time
+        return 0.0
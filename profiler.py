@@ -0,0 +1,145 @@
+"""Module with render timing instrumentation.
+"""
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from ctypes import byref
+import json
+import threading
+import time
+import numpy as np
+from ._lazy import LazyModule
+
+gl = LazyModule('pyglet.gl', globals(), 'gl')
+
+class RenderProfiler:
+    """Collects CPU wall time and GPU time of named render sections.
+
+    GPU time is measured with GL timestamp queries. Their results are collected
+    on later frames, when they are available, so measuring doesn't stall the GPU.
+
+    Args:
+        window (int): Number of latest samples statistics are computed over.
+        gpu (bool): Should GPU time be measured or not.
+    """
+    def __init__(self, window = 300, gpu = True):
+        self.window = window
+        self.gpu = gpu
+        self.cpu_times = {} # Section name -> deque of seconds
+        self.gpu_times = {}
+        self._pending = deque() # (name, start query, end query)
+        self._free_queries = []
+        # Sections may be measured on other threads (e.g. encoding) while
+        #   statistics are read
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def section(self, name, gpu = True):
+        """Context manager measuring time of enclosed code.
+
+        Args:
+            name (string): Name of the section.
+            gpu (bool): Measure GPU time too. Must be False when there is no
+                current OpenGL context, e.g. on other threads.
+        """
+        gpu = gpu and self.gpu
+        if gpu:
+            start_query = self._get_query()
+            gl.glQueryCounter(start_query, gl.GL_TIMESTAMP)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add(self.cpu_times, name, time.perf_counter() - start)
+            if gpu:
+                end_query = self._get_query()
+                gl.glQueryCounter(end_query, gl.GL_TIMESTAMP)
+                self._pending.append((name, start_query, end_query))
+
+    def end_frame(self):
+        """Collects results of finished GPU queries. Call once per frame."""
+        while self._pending:
+            name, start_query, end_query = self._pending[0]
+            available = gl.GLint(0)
+            gl.glGetQueryObjectiv(end_query, gl.GL_QUERY_RESULT_AVAILABLE, byref(available))
+            if not available.value:
+                break
+            self._collect()
+
+    def finish(self):
+        """Waits for and collects results of all GPU queries."""
+        while self._pending:
+            self._collect()
+
+    def release(self):
+        """Deletes GPU queries. OpenGL context of queries must be current."""
+        self.finish()
+        if self._free_queries:
+            ids = (gl.GLuint * len(self._free_queries))(*self._free_queries)
+            gl.glDeleteQueries(len(self._free_queries), ids)
+            self._free_queries = []
+
+    def stats(self):
+        """Returns statistics of each section.
+
+        Returns:
+            Dict mapping section name to dict with 'cpu' and 'gpu' entries. Each
+            has 'count', 'mean', 'p50' and 'p99' of times in seconds over the
+            latest samples or is None if section wasn't measured.
+        """
+        with self._lock:
+            cpu_times = {name: list(samples) for name, samples in self.cpu_times.items()}
+            gpu_times = {name: list(samples) for name, samples in self.gpu_times.items()}
+        names = list(cpu_times) + [name for name in gpu_times if name not in cpu_times]
+        return {
+            name: {
+                'cpu': _summarize(cpu_times.get(name)),
+                'gpu': _summarize(gpu_times.get(name)),
+            }
+            for name in names
+        }
+
+    def dump(self, path):
+        """Writes statistics of each section to JSON file."""
+        with open(path, 'w') as f:
+            json.dump(self.stats(), f, indent=2)
+
+    def _add(self, times, name, value):
+        with self._lock:
+            samples = times.get(name)
+            if samples is None:
+                samples = times[name] = deque(maxlen=self.window)
+            samples.append(value)
+
+    def _get_query(self):
+        if self._free_queries:
+            return self._free_queries.pop()
+        id = gl.GLuint(0)
+        gl.glGenQueries(1, byref(id))
+        return id.value
+
+    def _collect(self):
+        """Collects result of oldest pending GPU query. Waits for it if necessary."""
+        name, start_query, end_query = self._pending.popleft()
+        start = gl.GLuint64(0)
+        end = gl.GLuint64(0)
+        gl.glGetQueryObjectui64v(start_query, gl.GL_QUERY_RESULT, byref(start))
+        gl.glGetQueryObjectui64v(end_query, gl.GL_QUERY_RESULT, byref(end))
+        self._add(self.gpu_times, name, (end.value - start.value) * 1e-9)
+        self._free_queries += [start_query, end_query]
+
+def section(profiler, name, gpu = True):
+    """Returns profiler's section context manager or no-op one if profiler is None."""
+    if profiler is None:
+        return nullcontext()
+    return profiler.section(name, gpu)
+
+def _summarize(samples):
+    if not samples:
+        return None
+    values = np.array(samples)
+    return {
+        'count': len(values),
+        'mean': float(values.mean()),
+        'p50': float(np.percentile(values, 50)),
+        'p99': float(np.percentile(values, 99)),
+    }
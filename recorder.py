@@ -1,51 +1,202 @@
-import cv2
 import numpy as np
 import os
-from pyglet import gl
-from ctypes import POINTER
-from gym_duckietown.simulator import get_dir_vec, CAMERA_FORWARD_DIST
+from collections import deque
+from ctypes import POINTER, byref
 
 from . import drawable
-from .framebuffer import Framebuffer
+from ._lazy import LazyModule
+from .framebuffer import default_pool
 from .camera import CameraSettings
+from .encoder import FrameEncoder
+from .framepool import FramePool
+from .sinks import VideoSink
+from .profiler import RenderProfiler, section
+
+gl = LazyModule('pyglet.gl', globals(), 'gl')
+simulator = LazyModule('gym_duckietown.simulator', globals(), 'simulator')
+
+def static_content(env):
+    """Cache key for subframes whose content never changes."""
+    return True
+
 class RecorderSubFrame:
-    #TODO
+    """Subframe drawing environment from a camera.
+
+    Args:
+        camera_settings: CameraSettings used for drawing.
+        drawers: Drawables drawn with camera's matrices.
+        info_drawers: Drawables drawn in subframe's pixel coordinates.
+        clear_color: Background color.
+        cache_key: (optional) Function of environment returning hashable value
+            identifying subframe's content. When value is equal to the one from
+            previous frame, subframe isn't redrawn and its previous pixels are
+            reused. None returned from function means subframe has to be redrawn.
+        render_scale: Scale of resolution subframe is rendered at. Image is scaled
+            to subframe's size when put into frame, e.g. 0.5 renders quarter of
+            pixels, 2 supersamples.
+    """
     def __init__(self, camera_settings,
         drawers = [drawable.Tiles(), drawable.Objects(), drawable.Bot()],
         info_drawers = [],
-        clear_color = [0.45, 0.82, 1]
+        clear_color = [0.45, 0.82, 1],
+        cache_key = None,
+        render_scale = 1.0
     ):
         self.drawers = drawers
         self.info_drawers = info_drawers
+        # Text drawers of a list are drawn in one batch
+        self._drawers = drawable.batch_texts(drawers)
+        self._info_drawers = drawable.batch_texts(info_drawers)
         self.camera_settings = camera_settings
         self.width  = camera_settings.width
         self.height = camera_settings.height
         self.clear_color = clear_color
+        self.cache_key = cache_key
+        assert render_scale > 0
+        self.render_scale = render_scale
+        self.profiler = None # Set by Recorder when profiling
+        self.profile_name = ""
+
+    def get_cache_key(self, env):
+        """Returns value identifying subframe's content or None if it has to be redrawn."""
+        if self.cache_key is None:
+            return None
+        return self.cache_key(env)
 
     def draw(self, env):
         # Draw environment objects
         self.camera_settings.use(env)
         gl.glClearColor(*self.clear_color, 1.0)
         gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
-        for drawer in self.drawers:
-            drawer.draw(env)
+        _draw_drawers(env, self._drawers, self.profiler, self.profile_name)
 
         # Draw info
         gl.glDisable(gl.GL_DEPTH_TEST)
-        if len(self.info_drawers) > 0:
-            _draw_info(env, self.info_drawers, self.camera_settings.width,
-                self.camera_settings.height)
+        if len(self._info_drawers) > 0:
+            _draw_info(env, self._info_drawers, self.camera_settings.width,
+                self.camera_settings.height, self.profiler, self.profile_name)
         gl.glEnable(gl.GL_DEPTH_TEST)
 
 class RecorderBotViewSubFrame:
-    def __init__(self, width, height, info_drawers = []):
+    """Subframe showing what bot's camera sees.
+
+    Args:
+        width, height: Size of subframe.
+        info_drawers: Drawables drawn in subframe's pixel coordinates.
+        render_scale: See RecorderSubFrame.
+        source(render/observation): 'render' draws the scene from bot's camera.
+            'observation' reuses image the environment already rendered as
+            observation of the step: its framebuffer (env.final_fbo) is blitted
+            into the subframe or, if environment has none or it was rendered in
+            another context than recorder's (framebuffers aren't shared between
+            contexts), the array passed to set_observation is drawn.
+
+    Note: With 'observation' source and multisample Recorder, subframe's size
+        must be equal to environment's camera size.
+    """
+    def __init__(self, width, height, info_drawers = [], render_scale = 1.0, source = 'render'):
         self.width = width
         self.height = height
+        assert render_scale > 0
+        self.render_scale = render_scale
+        if source != 'render' and source != 'observation':
+            raise ValueError("Source parameter is invalid.")
+        self.source = source
         self.drawers = [drawable.Tiles(), drawable.Objects()]
         self.info_drawers = info_drawers
+        self._info_drawers = drawable.batch_texts(info_drawers)
         self.warned = False
+        self.profiler = None # Set by Recorder when profiling
+        self.profile_name = ""
+        self.context = None # Set by Recorder, context subframe is drawn in
+        self.observation = None
+        self._obs_texture = None
+        self._obs_shape = None
+
+    def set_observation(self, obs):
+        """Sets observation image (height x width x 3 RGB uint8, rows from top to
+        bottom) drawn with 'observation' source when environment has no framebuffer.
+        """
+        self.observation = obs
+
+    def get_cache_key(self, env):
+        # Bot's view changes with every step
+        return None
 
     def draw(self, env):
+        if self.source == 'observation':
+            self._draw_observation(env)
+        else:
+            self._draw_scene(env)
+
+        # Draw infos if neccessary
+        gl.glDisable(gl.GL_DEPTH_TEST) # Otherwise wouldn't be drawn
+        if len(self._info_drawers) > 0:
+            _draw_info(env, self._info_drawers, self.width, self.height,
+                self.profiler, self.profile_name)
+        gl.glEnable(gl.GL_DEPTH_TEST)
+
+    def _draw_observation(self, env):
+        """Copies environment's observation into subframe's viewport."""
+        viewport = (gl.GLint * 4)()
+        gl.glGetIntegerv(gl.GL_VIEWPORT, viewport)
+        x, y, width, height = viewport
+        final_fbo = getattr(env, 'final_fbo', None)
+        if final_fbo is not None and getattr(env, 'shadow_window', None) is self.context:
+            draw_fb = gl.GLint(0)
+            gl.glGetIntegerv(gl.GL_DRAW_FRAMEBUFFER_BINDING, byref(draw_fb))
+            gl.glBindFramebuffer(gl.GL_READ_FRAMEBUFFER, final_fbo)
+            gl.glBlitFramebuffer(0, 0, env.camera_width, env.camera_height,
+                x, y, x + width, y + height, gl.GL_COLOR_BUFFER_BIT, gl.GL_LINEAR)
+            gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, draw_fb.value)
+            return
+        if self.observation is None:
+            raise RuntimeError("Environment's observation framebuffer can't be used in recorder's context and no observation was set.")
+        self._upload_observation()
+
+        gl.glMatrixMode(gl.GL_PROJECTION)
+        gl.glLoadIdentity()
+        gl.glOrtho(0, 1, 0, 1, -1, 1)
+        gl.glMatrixMode(gl.GL_MODELVIEW)
+        gl.glLoadIdentity()
+        gl.glEnable(gl.GL_TEXTURE_2D)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self._obs_texture)
+        gl.glColor3f(1, 1, 1)
+        gl.glBegin(gl.GL_QUADS)
+        # Observation rows go from top to bottom
+        gl.glTexCoord2f(0, 1)
+        gl.glVertex2f(0, 0)
+        gl.glTexCoord2f(1, 1)
+        gl.glVertex2f(1, 0)
+        gl.glTexCoord2f(1, 0)
+        gl.glVertex2f(1, 1)
+        gl.glTexCoord2f(0, 0)
+        gl.glVertex2f(0, 1)
+        gl.glEnd()
+        gl.glDisable(gl.GL_TEXTURE_2D)
+
+    def _upload_observation(self):
+        obs = np.ascontiguousarray(self.observation, dtype=np.uint8)
+        height, width = obs.shape[:2]
+        if self._obs_texture is None:
+            texture = gl.GLuint(0)
+            gl.glGenTextures(1, byref(texture))
+            self._obs_texture = texture
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self._obs_texture)
+        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
+        data = obs.ctypes.data_as(POINTER(gl.GLubyte))
+        if self._obs_shape != obs.shape:
+            gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_LINEAR)
+            gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_LINEAR)
+            gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_RGB8, width, height, 0,
+                gl.GL_RGB, gl.GL_UNSIGNED_BYTE, data)
+            self._obs_shape = obs.shape
+        else:
+            gl.glTexSubImage2D(gl.GL_TEXTURE_2D, 0, 0, 0, width, height,
+                gl.GL_RGB, gl.GL_UNSIGNED_BYTE, data)
+
+    def _draw_scene(self, env):
+        """Draws the scene from bot's camera the same way environment does."""
         if (env.camera_width != self.width or env.camera_height != self.height):
             if not self.warned:
                 self.warned = True
@@ -71,13 +222,17 @@ class RecorderBotViewSubFrame:
 
         pos = pos + env.cam_offset
         pos[1] += env.cam_height
-        dir = get_dir_vec(angle)
+        dir = env.get_dir_vec(angle)
+        # Simulator keeps camera's forward shift in a module constant
+        forward_dist = getattr(env, 'camera_forward_dist', None)
+        if forward_dist is None:
+            forward_dist = simulator.CAMERA_FORWARD_DIST
         gl.glMatrixMode(gl.GL_MODELVIEW)
         gl.glLoadIdentity()
         gl.glRotatef(env.cam_angle[0], 1, 0, 0)
         gl.glRotatef(env.cam_angle[1], 0, 1, 0)
         gl.glRotatef(env.cam_angle[2], 0, 0, 1)
-        gl.glTranslatef(0, 0, env._perturb(CAMERA_FORWARD_DIST))
+        gl.glTranslatef(0, 0, env._perturb(forward_dist))
         gl.gluLookAt(
                 # Eye position
                 *pos,
@@ -99,17 +254,19 @@ class RecorderBotViewSubFrame:
         env.tri_vlist.draw(gl.GL_TRIANGLES)
 
         # Draw remaining objects
-        for drawer in self.drawers:
-            drawer.draw(env)
-
-        # Draw infos if neccessary
-        gl.glDisable(gl.GL_DEPTH_TEST) # Otherwise wouldn't be drawn
-        if len(self.info_drawers) > 0:
-            _draw_info(env, self.info_drawers, self.width, self.height)
-        gl.glEnable(gl.GL_DEPTH_TEST)
+        _draw_drawers(env, self.drawers, self.profiler, self.profile_name)
 
 class RecorderInfoSubFrame(RecorderSubFrame):
-    def __init__(self, width, height, drawers):
+    """Subframe with info drawers on black background.
+
+    Args:
+        width, height: Size of subframe.
+        drawers: Drawables to draw.
+        cache_key: (optional) See RecorderSubFrame. If none passed and all drawers
+            are Text, subframe is redrawn only when any of their strings changes.
+        render_scale: See RecorderSubFrame.
+    """
+    def __init__(self, width, height, drawers, cache_key = None, render_scale = 1.0):
         settings = CameraSettings(width, height,
             None,
             None,
@@ -119,21 +276,75 @@ class RecorderInfoSubFrame(RecorderSubFrame):
         super(RecorderInfoSubFrame, self).__init__(
             settings,
             drawers = drawers,
-            clear_color = [0] * 3
+            clear_color = [0] * 3,
+            cache_key = cache_key,
+            render_scale = render_scale
         )
 
+    def get_cache_key(self, env):
+        if self.cache_key is None:
+            if all(isinstance(drawer, drawable.Text) for drawer in self.drawers):
+                return tuple(drawer.info.get_str() for drawer in self.drawers)
+            return None
+        return self.cache_key(env)
+
 class Recorder:
     """Records experiment in videofile.
 
     Args:
-        filename: Path of a videofile that will be written.
+        filename: Path of a videofile that will be written. Passed to sink.
         shape: Rows and cols number of subframes.
         env: Environment object of simulation.
+        readback(sync/async): How rendered frames are read from GPU. 'sync' reads
+            each frame right after drawing it. 'async' reads through a ring of
+            pixel buffer objects, so frame is written to video when next frame
+            is rendered.
+        pbo_count: Number of pixel buffers used by 'async' readback.
+        threaded: Encode frames on a background thread instead of inside render.
+        queue_size: Maximal number of frames waiting for encoding when threaded.
+        backpressure(block/drop-oldest/drop-newest): What to do with a new frame
+            when encoding queue is full (see FrameEncoder).
+        split_by_env: Write separate video for each environment subframes are bound
+            to (see set_subframe). Each video contains the smallest block of cells
+            holding all subframes of its environment. Videos are named by adding
+            environment's index to filename, index 0 is env passed here.
+        fps: Frame rate of written video.
+        sim_dt: (optional) Simulated time in seconds passing between render calls,
+            e.g. env.delta_time. If passed, frame is rendered only when a new video
+            frame is due. If none passed, every render call writes a frame.
+        duplicate_frames: When sim_dt is passed and several video frames are due
+            at once, write rendered frame several times so video plays in real time.
+        sink: Callable creating FrameSink from path, e.g. sinks.VideoSink,
+            sinks.RawFrameStore, sinks.ImageSequenceSink or sinks.SegmentedVideoSink.
+        profile: Measure CPU and GPU time of pipeline stages, subframes and
+            drawers. Statistics are available from profiler attribute.
+        profile_file: (optional) Path of JSON file statistics are written to on close.
+        samples: Number of samples per pixel used for multisample antialiasing of
+            the whole frame. 0 disables multisampling.
+        fb_pool: (optional) FramebufferPool framebuffers are taken from and
+            returned to on close. If none passed, framebuffer.default_pool is used.
+        context: (optional) OpenGL context frames are rendered in, an object with
+            switch_to method, e.g. context.HeadlessContext environment was built
+            in, so no window or X server is needed. Environments' OpenGL objects
+            must be usable in it. If none passed, env.shadow_window is used.
+            Stock gym_duckietown Simulator can't be recorded headless, because
+            it creates its OpenGL objects in a pyglet window, which needs X
+            server; environment has to be built in the context (see
+            benchmarks.stub_env.StubEnv).
     """
-    def __init__(self, file, shape, env):
+    def __init__(self, file, shape, env, readback = 'sync', pbo_count = 2,
+        threaded = False, queue_size = 32, backpressure = 'block',
+        split_by_env = False, fps = 15, sim_dt = None, duplicate_frames = False,
+        sink = VideoSink, profile = False, profile_file = None,
+        samples = 0, fb_pool = None, context = None
+    ):
         # TODO: Don't delete already existing files
         # TODO: Use crossplatform paths?
-        self.context  = env.shadow_window
+        if context is None:
+            context = env.shadow_window
+        elif _object_space(getattr(env, 'shadow_window', context)) is not _object_space(context):
+            raise ValueError("Environment doesn't share OpenGL objects with passed context.")
+        self.context  = context
         self.context.switch_to()
         self.filepath = os.path.dirname(file)
         self.filename = os.path.basename(file)
@@ -141,32 +352,83 @@ class Recorder:
         # print(self.filename)
         self.shape  = shape
         self.ready  = False #
-        self.fb = self.writer = None
+        self.fb = self.read_fb = None
+        self.sink   = sink
+        self.sinks  = [] # (crop of frame or None, FrameSink) pairs
+        self.pool = None
         self.subframes  = [[None for x in range(self.shape[1])] for y in range(self.shape[0])]
+        self.subframe_envs = [[None for x in range(self.shape[1])] for y in range(self.shape[0])]
         self.env    = env
-
-    def set_subframe(self, row, column, subframe):
+        self.envs   = [env] # All environments subframes can be bound to
+        self.split_by_env = split_by_env
+        if readback != 'sync' and readback != 'async':
+            raise ValueError("Readback parameter is invalid.")
+        self.readback  = readback
+        self.pbo_count = pbo_count
+        self.threaded  = threaded
+        self.queue_size   = queue_size
+        self.backpressure = backpressure
+        self.encoder = None
+        self.dropped_frames = 0
+        assert fps > 0
+        assert sim_dt is None or sim_dt > 0
+        self.fps    = fps
+        self.sim_dt = sim_dt
+        self.duplicate_frames = duplicate_frames
+        self.render_calls = 0 # Number of render calls, used as simulation clock
+        self.frames_due   = 0 # Number of video frames due so far
+        self._pending_repeats = deque() # Repeats of frames with pending readback
+        self.profiler = RenderProfiler() if profile or profile_file else None
+        self.profile_file = profile_file
+        self.samples = samples
+        self.fb_pool = fb_pool or default_pool
+
+    def set_subframe(self, row, column, subframe, env = None):
         """Sets subframe at specified row and column.
         
         Args:
             row: Row position.
             column: Column position.
             subframe: Subframe object to be set.
+            env: (optional) Environment drawn by subframe. If none passed,
+                recorder's environment is used. All environments are rendered
+                into one framebuffer, so their OpenGL objects must be shared
+                with recorder's context (as pyglet windows' objects are).
 
         Note:
             (0, 0) is top-bottom corner of frame.
         """
         # TODO: asserts or exceptions?
         # TODO: Print message along with an error
-        assert not self.writer # Can't change subframes when recording
+        assert not self.sinks # Can't change subframes when recording
         assert row    <  self.shape[0]
         assert row    >= 0
         assert column <  self.shape[1]
         assert column >= 0
+        # Checked before recording starts, so no sink or framebuffer is left open
+        if self.samples > 0 and getattr(subframe, 'render_scale', 1.0) != 1.0:
+            raise ValueError("Render scale of subframes can't be used with multisampling.")
+        if env is not None:
+            if _object_space(getattr(env, 'shadow_window', self.context)) is not _object_space(self.context):
+                raise ValueError("Environment doesn't share OpenGL objects with recorder's context.")
+            if all(env is not e for e in self.envs):
+                self.envs.append(env)
 
         self.subframes[row][column] = subframe
+        self.subframe_envs[row][column] = env
 
     def _init(self):
+        with section(self.profiler, "layout", gpu=False):
+            self._init_layout()
+        for row, frameRow in enumerate(self.subframes):
+            for col, subframe in enumerate(frameRow):
+                if subframe is not None:
+                    subframe.profiler = self.profiler
+                    if isinstance(subframe, RecorderBotViewSubFrame):
+                        subframe.context = self.context
+                    subframe.profile_name = "subframe[{},{}]".format(row, col)
+
+    def _init_layout(self):
         """Figure out video's width and height required to fit all the subviews"""
         self.min_widths  = [-np.Inf]*self.shape[1] # For each column
         self.min_heights = [-np.Inf]*self.shape[0] # For each row
@@ -185,29 +447,94 @@ class Recorder:
 
         self.width  = sum(self.min_widths)
         self.height = sum(self.min_heights)
-
-        self._init_writer()
-
-        if not self.fb:
-            self.fb = Framebuffer(self.width, self.height)
+        # Cache keys of subframes' content drawn in the framebuffer
+        self.cache_keys = [[None] * self.shape[1] for _ in range(self.shape[0])]
+
+        self._init_sinks()
+        if self.threaded:
+            self.encoder = FrameEncoder(self._encode, self.queue_size, self.backpressure)
+
+        self.fb = self.fb_pool.acquire(self.width, self.height, self.context,
+            samples=self.samples)
+        # Frames are flipped on GPU while copying into read_fb, so rows are
+        #   read back in OpenCV's top to bottom order without a CPU copy
+        self.read_fb = self.fb_pool.acquire(self.width, self.height, self.context)
+        if self.readback == 'async':
+            self.read_fb.create_pbo_ring(self.pbo_count)
+        # Offscreen framebuffers of subframes rendered at different resolution
+        self.scaled_fbs = {}
+        for row, frameRow in enumerate(self.subframes):
+            for col, subframe in enumerate(frameRow):
+                scale = getattr(subframe, 'render_scale', 1.0)
+                if subframe is None or scale == 1.0:
+                    continue
+                self.scaled_fbs[row, col] = self.fb_pool.acquire(
+                    max(1, round(subframe.width * scale)),
+                    max(1, round(subframe.height * scale)),
+                    self.context)
+        # Layout may change between recordings
+        if not self.pool or self.pool.shape != (self.height, self.width, 3):
+            self.pool = FramePool((self.height, self.width, 3))
 
         self.ready = True
 
-    def _init_writer(self):
-        if not os.path.exists(self.filepath):
+    def _init_sinks(self):
+        if self.filepath and not os.path.exists(self.filepath):
             os.makedirs(self.filepath)
-        # TODO: FPS is const and can be too fast or slow
-        self.writer = cv2.VideoWriter(
-                                      os.path.join(self.filepath, self.filename),
-                                      cv2.VideoWriter_fourcc(*'mp4v'),
-                                      15,
-                                      (self.width, self.height)
-                                     )
+        if not self.split_by_env:
+            self.sinks = [(None, self._create_sink(self.filename, self.width, self.height))]
+            return
+        name, ext = os.path.splitext(self.filename)
+        for index, env in enumerate(self.envs):
+            crop = self._get_env_crop(env)
+            if crop is None:
+                continue
+            rows, cols = crop
+            sink = self._create_sink("{}_{}{}".format(name, index, ext),
+                cols.stop - cols.start, rows.stop - rows.start)
+            self.sinks.append((crop, sink))
+
+    def _create_sink(self, filename, width, height):
+        sink = self.sink(os.path.join(self.filepath, filename))
+        sink.open(width, height, self.fps)
+        return sink
+
+    def _get_env_crop(self, env):
+        """Returns (rows, columns) slices of frame image covering all cells with
+        subframes of environment or None if environment has no subframes.
+        """
+        cells = [(row, col)
+            for row in range(self.shape[0])
+            for col in range(self.shape[1])
+            if self.subframes[row][col] is not None and self._get_env(row, col) is env]
+        if not cells:
+            return None
+        rows = [row for row, _ in cells]
+        cols = [col for _, col in cells]
+        x0 = sum(self.min_widths[:min(cols)])
+        x1 = sum(self.min_widths[:max(cols) + 1])
+        y0 = sum(self.min_heights[:min(rows)])
+        y1 = sum(self.min_heights[:max(rows) + 1])
+        # Framebuffer rows go from bottom to top, image rows from top to bottom
+        return (slice(self.height - y1, self.height - y0), slice(x0, x1))
+
+    def _get_env(self, row, col):
+        env = self.subframe_envs[row][col]
+        return self.env if env is None else env
 
     def render(self):
-        # TODO: docstring
         """Render video frame from all connected subframes.
+
+        Returns:
+            Image of the frame that was written to video or None if no frame was
+            written. With 'async' readback that is the frame rendered by the
+            previous call. Image rows are in top to bottom order and its array
+            is reused, so it's valid only until the next render call.
         """
+        repeat = self._get_due_frames()
+        if repeat == 0:
+            return None
+
         self.context.switch_to()
         # Switch context before creating Framebuffer in _init
 
@@ -215,6 +542,8 @@ class Recorder:
             self._init()
 
         self.fb.use()
+        if self.samples > 0:
+            gl.glEnable(gl.GL_MULTISAMPLE)
 
         # Render each subframe
         gl.glEnable(gl.GL_SCISSOR_TEST) # For restricting glClear to specific rectangle
@@ -224,38 +553,154 @@ class Recorder:
             for col, subframe in enumerate(frameRow):
                 if subframe is None:
                     continue
-                gl.glViewport(xorigin, yorigin, subframe.width, subframe.height)
-                gl.glScissor(xorigin, yorigin, subframe.width, subframe.height)
-                subframe.draw(self.env) if subframe else None
+                env = self._get_env(row, col)
+                key = subframe.get_cache_key(env)
+                if key is None or key != self.cache_keys[row][col]:
+                    scaled_fb = self.scaled_fbs.get((row, col))
+                    with section(self.profiler, subframe.profile_name):
+                        if scaled_fb:
+                            scaled_fb.use()
+                            gl.glScissor(0, 0, scaled_fb.width, scaled_fb.height)
+                            subframe.draw(env)
+                            # Scissor restricts blit to subframe's rectangle too
+                            gl.glScissor(xorigin, yorigin, subframe.width, subframe.height)
+                            scaled_fb.blit_to_rect(self.fb, xorigin, yorigin,
+                                subframe.width, subframe.height)
+                        else:
+                            gl.glViewport(xorigin, yorigin, subframe.width, subframe.height)
+                            gl.glScissor(xorigin, yorigin, subframe.width, subframe.height)
+                            subframe.draw(env)
+                    self.cache_keys[row][col] = key
+                # Otherwise pixels drawn on previous frame are still in framebuffer
                 xorigin += self.min_widths[col]
             yorigin += self.min_heights[row]
-
-        img = np.zeros(shape=(self.height, self.width, 3), dtype=np.uint8)
-
-        gl.glReadPixels(0,0,
-            self.width, self.height,
-            gl.GL_BGR, # cv2 uses BGR format instead of RGB
-            gl.GL_UNSIGNED_BYTE,
-            img.ctypes.data_as(POINTER(gl.GLubyte)))
         gl.glDisable(gl.GL_SCISSOR_TEST)
+
+        with section(self.profiler, "flip"):
+            self.fb.blit(self.read_fb, flip_vertically=True)
+
+        if self.readback == 'async':
+            with section(self.profiler, "readback"):
+                self.read_fb.pbo_ring.start_read()
+            self._pending_repeats.append(repeat)
+            img = None
+            # Ring is full - oldest frame was read while this one was drawn
+            if len(self.read_fb.pbo_ring.pending) == self.read_fb.pbo_ring.size:
+                img = self._finish_read()
+        else:
+            img = self.pool.acquire()
+
+            with section(self.profiler, "readback"):
+                gl.glPixelStorei(gl.GL_PACK_ALIGNMENT, 1)
+                gl.glReadPixels(0,0,
+                    self.width, self.height,
+                    gl.GL_BGR, # cv2 uses BGR format instead of RGB
+                    gl.GL_UNSIGNED_BYTE,
+                    img.ctypes.data_as(POINTER(gl.GLubyte)))
+            self._write_frame(img, repeat)
         gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, 0)
 
-        self.writer.write(cv2.flip(img, 0))
+        if self.profiler:
+            self.profiler.end_frame()
+        return img
 
+    def _get_due_frames(self):
+        """Advances simulation clock and returns how many times frame should be
+        written on this render call. 0 means that frame shouldn't be rendered.
+        """
+        if self.sim_dt is None:
+            return 1
+        # Video frame k is due at simulation time k / fps
+        time = self.render_calls * self.sim_dt
+        self.render_calls += 1
+        due = int(time * self.fps + 1e-6) + 1
+        if due <= self.frames_due:
+            return 0
+        repeat = due - self.frames_due if self.duplicate_frames else 1
+        self.frames_due = due
+        return repeat
+
+    def _finish_read(self):
+        """Finishes oldest pending asynchronous readback and writes the frame."""
+        img = self.pool.acquire()
+        with section(self.profiler, "readback_finish", gpu=False):
+            self.read_fb.pbo_ring.finish_read(img)
+        self._write_frame(img, self._pending_repeats.popleft())
         return img
 
+    def _write_frame(self, img, repeat = 1):
+        if self.encoder:
+            dropped = self.encoder.put((img, repeat))
+            if dropped is not None:
+                self.pool.release(dropped[0])
+        else:
+            self._encode((img, repeat))
+
+    def _encode(self, frame):
+        img, repeat = frame
+        # May run on encoder thread without OpenGL context
+        with section(self.profiler, "encode", gpu=False):
+            for crop, sink in self.sinks:
+                for _ in range(repeat):
+                    sink.write(img if crop is None else img[crop])
+        self.pool.release(img)
+
     def close(self):
-        # TODO: docstring
+        """Writes frames with unfinished readback or encoding and closes sinks.
+
+        Returns:
+            Number of frames dropped by encoding queue backpressure.
+        """
         if self.ready:
-            self.writer.release()
-            self.writer = None
+            if self.readback == 'async':
+                self.context.switch_to()
+                while self.read_fb.pbo_ring.pending:
+                    self._finish_read()
+            if self.encoder:
+                dropped = self.encoder.close()
+                self.dropped_frames += dropped
+                self.encoder = None
+                if dropped > 0:
+                    print("Warning: {} frames were dropped while encoding {}."
+                        .format(dropped, self.filename))
+            for _, sink in self.sinks:
+                sink.close()
+            self.sinks = []
+            # Framebuffers are reused by next recording or other recorders
+            self.fb_pool.release(self.fb)
+            self.fb_pool.release(self.read_fb)
+            for fb in self.scaled_fbs.values():
+                self.fb_pool.release(fb)
+            self.fb = self.read_fb = None
+            self.scaled_fbs = {}
+            if self.profiler:
+                self.context.switch_to()
+                self.profiler.release()
+                if self.profile_file:
+                    self.profiler.dump(self.profile_file)
             self.ready  = False
+        return self.dropped_frames
+
+def _object_space(context):
+    """Returns object shared by contexts which share OpenGL objects (textures, buffers)."""
+    gl_context = getattr(context, 'context', None) # pyglet window's context
+    if gl_context is None:
+        return context
+    return gl_context.object_space
 
-def _draw_info(env, drawers, width, height):
+def _draw_info(env, drawers, width, height, profiler = None, profile_name = ""):
     gl.glMatrixMode(gl.GL_PROJECTION)
     gl.glLoadIdentity()
     gl.glOrtho(0, width, 0, height, -1, 1)
     gl.glMatrixMode(gl.GL_MODELVIEW)
     gl.glLoadIdentity()
-    for drawer in drawers:
-        drawer.draw(env)
+    _draw_drawers(env, drawers, profiler, profile_name + "/info")
+
+def _draw_drawers(env, drawers, profiler = None, profile_name = ""):
+    if profiler is None:
+        for drawer in drawers:
+            drawer.draw(env)
+        return
+    for i, drawer in enumerate(drawers):
+        with profiler.section("{}/{}[{}]".format(profile_name, type(drawer).__name__, i)):
+            drawer.draw(env)
@@ -0,0 +1,382 @@
+"""Module with frame sinks used by Recorder to store rendered frames.
+"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from multiprocessing import resource_tracker, shared_memory
+import os
+import shutil
+import struct
+import subprocess
+import numpy as np
+from ._lazy import LazyModule
+
+cv2 = LazyModule('cv2', globals(), 'cv2')
+
+class FrameSink:
+    """Base class for frame sinks.
+
+    Frames are BGR uint8 images of height x width x 3 with rows in top to bottom
+    order. Frame passed to write may be reused after the call returns.
+
+    Args:
+        path: Path of the output.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def open(self, width, height, fps):
+        """Prepares sink for frames of passed size."""
+        raise NotImplementedError("Method is not implemented")
+
+    def write(self, img):
+        raise NotImplementedError("Method is not implemented")
+
+    def close(self):
+        pass
+
+class VideoSink(FrameSink):
+    """Writes frames to videofile with cv2.VideoWriter.
+
+    Args:
+        path: Path of videofile.
+        fourcc (string): Codec of video.
+    """
+    def __init__(self, path, fourcc = 'mp4v'):
+        super(VideoSink, self).__init__(path)
+        self.fourcc = fourcc
+        self.writer = None
+
+    def open(self, width, height, fps):
+        self.writer = cv2.VideoWriter(
+                                      self.path,
+                                      cv2.VideoWriter_fourcc(*self.fourcc),
+                                      fps,
+                                      (width, height)
+                                     )
+
+    def write(self, img):
+        self.writer.write(img)
+
+    def close(self):
+        if self.writer:
+            self.writer.release()
+            self.writer = None
+
+class RawFrameStore(FrameSink):
+    """Stores frames losslessly in a memory-mapped .npy file.
+
+    File holds uint8 array of frames x height x width x 3, which can be loaded
+    with np.load(path, mmap_mode='r'). Frames are copied straight into mapped
+    file, which grows when preallocated frames are used up.
+
+    Args:
+        path: Path of .npy file.
+        capacity (int): Number of frames preallocated in file.
+    """
+    def __init__(self, path, capacity = 1024):
+        super(RawFrameStore, self).__init__(path)
+        assert capacity > 0
+        self.capacity = capacity
+        self.count = 0
+        self._mm = None
+
+    def open(self, width, height, fps):
+        self.frame_shape = (height, width, 3)
+        self.count = 0
+        self.header_size = npy_header_size('|u1', self.frame_shape)
+        with open(self.path, 'wb') as f:
+            f.write(self._header(self.capacity))
+        self._map(self.capacity)
+
+    def write(self, img):
+        if self.count == self.capacity:
+            self._map(self.capacity * 2)
+        self._mm[self.count] = img
+        self.count += 1
+
+    def close(self):
+        if self._mm is None:
+            return
+        self._mm.flush()
+        self._mm = None
+        # Drop unused preallocated frames
+        with open(self.path, 'r+b') as f:
+            f.write(self._header(self.count))
+            f.truncate(self.header_size + self.count * int(np.prod(self.frame_shape)))
+
+    def _map(self, capacity):
+        """Resizes file to passed number of frames and maps it."""
+        if self._mm is not None:
+            self._mm.flush()
+            self._mm = None
+        with open(self.path, 'r+b') as f:
+            f.write(self._header(capacity))
+            f.truncate(self.header_size + capacity * int(np.prod(self.frame_shape)))
+        self.capacity = capacity
+        self._mm = np.memmap(self.path, dtype=np.uint8, mode='r+',
+            offset=self.header_size, shape=(capacity,) + self.frame_shape)
+
+    def _header(self, count):
+        return npy_header('|u1', (count,) + self.frame_shape, self.header_size)
+
+class ImageSequenceSink(FrameSink):
+    """Writes each frame to a separate image file.
+
+    Args:
+        path: Directory of images.
+        ext (string): Image extension used by cv2.imwrite, e.g. '.png' or '.jpg'.
+        params (list): Parameters passed to cv2.imwrite, e.g. [cv2.IMWRITE_JPEG_QUALITY, 90].
+    """
+    def __init__(self, path, ext = '.png', params = None):
+        super(ImageSequenceSink, self).__init__(path)
+        self.ext = ext
+        self.params = params or []
+        self.count = 0
+
+    def open(self, width, height, fps):
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        self.count = 0
+
+    def write(self, img):
+        filename = os.path.join(self.path, "frame_{:06d}{}".format(self.count, self.ext))
+        cv2.imwrite(filename, img, self.params)
+        self.count += 1
+
+class SegmentedVideoSink(FrameSink):
+    """Encodes video as fixed-length segments concurrently in worker processes.
+
+    Frames of a segment are copied into a block of shared memory, which is
+    passed to a worker process when segment is full. Blocks are taken from a
+    small fixed ring, whose total size is bounded by max_shm_bytes; when all
+    blocks are in use, write waits for the oldest segment to be encoded. On
+    close segments are stitched into the final videofile with ffmpeg (without
+    reencoding) or, if stitching is disabled or ffmpeg isn't available, left
+    next to it with a playlist in ffconcat format.
+
+    Args:
+        path: Path of final videofile.
+        segment_frames (int): Number of frames in each segment. If none passed,
+            it's derived from max_shm_bytes and frame size (at most 900).
+        workers (int): Number of worker processes. If none passed, number of CPUs.
+        fourcc (string): Codec of video.
+        stitch (bool): Should segments be stitched into a single file or not.
+        max_shm_bytes (int): Maximal size of all shared memory blocks. Default
+            fits into Docker's default 64 MB /dev/shm.
+    """
+    MAX_SEGMENT_FRAMES = 900 # Upper bound of derived segment length
+    MIN_SEGMENT_FRAMES = 30 # Derived segments are at least this long if budget allows
+
+    def __init__(self, path, segment_frames = None, workers = None, fourcc = 'mp4v',
+        stitch = True, max_shm_bytes = 48 * 2 ** 20
+    ):
+        super(SegmentedVideoSink, self).__init__(path)
+        assert segment_frames is None or segment_frames > 0
+        assert max_shm_bytes > 0
+        self.segment_frames = segment_frames
+        self.workers = workers or os.cpu_count() or 1
+        self.fourcc = fourcc
+        self.stitch = stitch
+        self.max_shm_bytes = max_shm_bytes
+        self.segments = [] # Paths of segment files
+        self._pool = None
+
+    def open(self, width, height, fps):
+        self.frame_shape = (height, width, 3)
+        self.fps = fps
+        self.segments = []
+        self._jobs = deque() # (future, block) of segments being encoded
+        self._block = None # Block being filled
+        self._count = 0
+        self._frames_per_block, block_count = self._plan(int(np.prod(self.frame_shape)))
+        nbytes = self._frames_per_block * int(np.prod(self.frame_shape))
+        self._blocks = [shared_memory.SharedMemory(create=True, size=nbytes)
+            for _ in range(block_count)]
+        self._free = deque(self._blocks)
+        # Forking would copy live OpenGL context and X connection, possibly
+        #   from encoder thread while main thread is inside GL calls
+        self._pool = ProcessPoolExecutor(self.workers,
+            mp_context=multiprocessing.get_context('spawn'))
+
+    def _plan(self, frame_bytes):
+        """Returns frames per segment and number of shared memory blocks."""
+        # One block is filled while workers encode the others
+        if self.segment_frames:
+            frames = self.segment_frames
+            if frames * frame_bytes > self.max_shm_bytes:
+                raise ValueError("Segment of {} frames doesn't fit into max_shm_bytes."
+                    .format(frames))
+            return frames, min(self.workers + 1, self.max_shm_bytes // (frames * frame_bytes))
+        frames_total = self.max_shm_bytes // frame_bytes
+        if frames_total < 1:
+            raise ValueError("Frame doesn't fit into max_shm_bytes.")
+        # Fewer blocks in flight rather than segments shorter than minimum
+        blocks = max(1, min(self.workers + 1, frames_total // self.MIN_SEGMENT_FRAMES))
+        return min(self.MAX_SEGMENT_FRAMES, frames_total // blocks), blocks
+
+    def write(self, img):
+        if self._block is None:
+            if not self._free:
+                self._wait_oldest()
+            self._block = self._free.popleft()
+            self._frames = np.ndarray((self._frames_per_block,) + self.frame_shape,
+                dtype=np.uint8, buffer=self._block.buf)
+            self._count = 0
+        self._frames[self._count] = img
+        self._count += 1
+        if self._count == self._frames_per_block:
+            self._submit()
+
+    def close(self):
+        if self._pool is None:
+            return
+        try:
+            if self._block is not None:
+                self._submit()
+            while self._jobs:
+                self._wait_oldest()
+        finally:
+            # Blocks are released even when encoding of a segment failed
+            for future, _ in self._jobs:
+                future.cancel()
+            self._pool.shutdown()
+            self._pool = None
+            self._jobs.clear()
+            self._frames = None
+            for block in self._blocks:
+                block.close()
+                block.unlink()
+            self._blocks = []
+            self._free.clear()
+        self._finalize()
+
+    def _submit(self):
+        """Passes current segment to worker process."""
+        name, ext = os.path.splitext(self.path)
+        segment = "{}_seg{:05d}{}".format(name, len(self.segments), ext)
+        self.segments.append(segment)
+        future = self._pool.submit(_encode_segment, self._block.name, self._count,
+            self.frame_shape, segment, self.fourcc, self.fps)
+        self._jobs.append((future, self._block))
+        self._frames = None
+        self._block = None
+
+    def _wait_oldest(self):
+        """Waits for oldest segment to be encoded and returns its block to the ring."""
+        future, block = self._jobs.popleft()
+        try:
+            future.result()
+        finally:
+            self._free.append(block)
+
+    def _finalize(self):
+        concat_segments(self.path, self.segments, self.stitch)
+
+def concat_segments(path, segments, stitch = True):
+    """Stitches videofiles of segments into one videofile or writes their playlist.
+
+    Args:
+        path: Path of final videofile. Playlist is written to path + '.ffconcat'.
+        segments: Paths of segments in order.
+        stitch (bool): Should segments be stitched with ffmpeg (without reencoding)
+            or not. If not or if stitching fails, segments are left with playlist.
+    """
+    directory = os.path.dirname(path)
+    playlist = path + '.ffconcat'
+    with open(playlist, 'w') as f:
+        f.write("ffconcat version 1.0\n")
+        for segment in segments:
+            f.write("file '{}'\n".format(os.path.relpath(segment, directory or '.')))
+    if not stitch:
+        return
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        print("Warning: ffmpeg not found, segments of {} are left with playlist {}."
+            .format(path, playlist))
+        return
+    res = subprocess.run([ffmpeg, '-y', '-loglevel', 'error', '-safe', '0',
+        '-f', 'concat', '-i', playlist, '-c', 'copy', path])
+    if res.returncode != 0:
+        print("Warning: failed to stitch segments of {}, they are left with playlist {}."
+            .format(path, playlist))
+        return
+    for segment in segments:
+        os.remove(segment)
+    os.remove(playlist)
+
+class NpyAppender:
+    """Appends rows to a .npy file.
+
+    Header is rewritten after each append, so file can be loaded (e.g. with
+    np.load(path, mmap_mode='r')) while rows are still being appended.
+
+    Args:
+        path: Path of .npy file.
+        dtype: Type of array elements, may be structured.
+        row_shape: Shape of each row.
+    """
+    def __init__(self, path, dtype, row_shape = ()):
+        self.dtype = np.dtype(dtype)
+        self.row_shape = tuple(row_shape)
+        self.count = 0
+        self._descr = np.lib.format.dtype_to_descr(self.dtype)
+        self.header_size = npy_header_size(self._descr, self.row_shape)
+        self._file = open(path, 'wb')
+        self._file.write(self._header())
+
+    def append(self, rows):
+        """Appends array of rows x row_shape."""
+        rows = np.ascontiguousarray(rows, dtype=self.dtype)
+        assert rows.shape[1:] == self.row_shape
+        self._file.seek(0, os.SEEK_END)
+        self._file.write(rows.tobytes())
+        self.count += len(rows)
+        self._file.seek(0)
+        self._file.write(self._header())
+        self._file.flush()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def _header(self):
+        return npy_header(self._descr, (self.count,) + self.row_shape, self.header_size)
+
+def npy_header_size(descr, row_shape):
+    """Returns size of .npy header which fits any number of rows of passed shape.
+
+    Fixed size lets header be rewritten in place when number of rows changes.
+    """
+    header = "{{'descr': {!r}, 'fortran_order': False, 'shape': {}, }}".format(
+        descr, (2 ** 63,) + tuple(row_shape))
+    # Magic, version and length take 10 bytes, newline 1, data is 64-byte aligned
+    return (10 + len(header) + 1 + 63) // 64 * 64
+
+def npy_header(descr, shape, size):
+    """Returns .npy format version 1.0 header padded to passed size in bytes."""
+    header = "{{'descr': {!r}, 'fortran_order': False, 'shape': {}, }}".format(descr, shape)
+    header = header.ljust(size - 10 - 1) + '\n'
+    assert len(header) + 10 == size
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1')
+
+def _encode_segment(shm_name, count, frame_shape, path, fourcc, fps):
+    """Encodes frames from shared memory into videofile. Runs in worker process."""
+    try:
+        shm = shared_memory.SharedMemory(name=shm_name, track=False)
+    except TypeError:
+        # Python < 3.13 registers attached memory to be unlinked when worker
+        #   exits, but blocks are reused and unlinked by the sink
+        shm = shared_memory.SharedMemory(name=shm_name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    try:
+        frames = np.ndarray((count,) + tuple(frame_shape), dtype=np.uint8, buffer=shm.buf)
+        height, width = frame_shape[:2]
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), fps, (width, height))
+        for frame in frames:
+            writer.write(frame)
+        writer.release()
+        del frames
+    finally:
+        shm.close()
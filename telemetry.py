@@ -0,0 +1,142 @@
+"""Module with columnar on-disk store of Info values sampled every step.
+"""
+import os
+import numpy as np
+from .sinks import NpyAppender
+
+class TelemetryWriter:
+    """Samples Info objects every step into per-metric .npy files in a directory.
+
+    Each metric is a column file holding array of rows x value shape. Besides
+    metrics there are 'step' (env.step_count) and 'episode' (index of episode,
+    incremented when step count decreases) columns. Rows are buffered in memory
+    and appended in chunks; headers are updated on each append, so files can be
+    loaded with np.load(path, mmap_mode='r') or TelemetryReader during the run.
+
+    Args:
+        path: Directory of column files.
+        env: Environment infos are sampled from.
+        infos (dict): Metric names mapped to Info objects. Values must be numbers
+            or fixed-size numeric arrays.
+        chunk_steps (int): Number of rows buffered before they are written.
+        dtype: Type values of metrics are stored as.
+    """
+    def __init__(self, path, env, infos, chunk_steps = 4096, dtype = np.float64):
+        for name in infos:
+            if name in ('step', 'episode') or os.sep in name:
+                raise ValueError("Metric name '{}' is invalid.".format(name))
+        assert chunk_steps > 0
+        self.path = path
+        self.env = env
+        self.infos = dict(infos)
+        self.chunk_steps = chunk_steps
+        self.dtype = dtype
+        self.count = 0
+        self.episode = -1
+        self.last_step = None
+        self._columns = None # Name -> (NpyAppender, buffer of rows)
+        self._buffered = 0
+
+    def record(self, env = None):
+        """Appends row of current values of infos. Call after every step."""
+        if env == None:
+            env = self.env
+        step = env.step_count
+        if self.last_step is None or step < self.last_step:
+            self.episode += 1
+        self.last_step = step
+        values = {name: info(env) for name, info in self.infos.items()}
+        values['step'] = step
+        values['episode'] = self.episode
+        if self._columns is None:
+            self._open(values)
+        if self._buffered == self.chunk_steps:
+            self._flush()
+        for name, (_, buffer) in self._columns.items():
+            buffer[self._buffered] = values[name]
+        self._buffered += 1
+        self.count += 1
+
+    def close(self):
+        """Writes buffered rows and closes column files."""
+        if self._columns is None:
+            return
+        self._flush()
+        for appender, _ in self._columns.values():
+            appender.close()
+        self._columns = None
+
+    def _open(self, values):
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        self._columns = {}
+        for name, value in values.items():
+            if name == 'step':
+                dtype = np.int64
+            elif name == 'episode':
+                dtype = np.int32
+            else:
+                dtype = self.dtype
+            shape = np.shape(value)
+            appender = NpyAppender(os.path.join(self.path, name + '.npy'), dtype, shape)
+            self._columns[name] = (appender, np.zeros((self.chunk_steps,) + shape, dtype=dtype))
+        self._buffered = 0
+
+    def _flush(self):
+        for appender, buffer in self._columns.values():
+            appender.append(buffer[:self._buffered])
+        self._buffered = 0
+
+class TelemetryReader:
+    """Reads telemetry written by TelemetryWriter.
+
+    Columns are memory-mapped, so slicing reads only the requested rows.
+
+    Args:
+        path: Directory of column files.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.columns = {}
+        for filename in sorted(os.listdir(path)):
+            name, ext = os.path.splitext(filename)
+            if ext == '.npy':
+                self.columns[name] = np.load(os.path.join(path, filename), mmap_mode='r')
+        # Columns may differ by rows being written right now
+        self.count = min(len(column) for column in self.columns.values()) if self.columns else 0
+        self.metrics = [name for name in self.columns if name not in ('step', 'episode')]
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, name):
+        """Returns memory-mapped column of metric, 'step' or 'episode'."""
+        return self.columns[name][:self.count]
+
+    def slice(self, start = None, stop = None, names = None):
+        """Returns dict of columns (all if names isn't passed) of rows in [start, stop)."""
+        names = names or list(self.columns)
+        return {name: self[name][start:stop] for name in names}
+
+    def episodes(self):
+        """Returns (start, stop) row ranges of episodes."""
+        episode = self['episode']
+        bounds = np.flatnonzero(np.diff(episode) != 0) + 1
+        starts = np.concatenate([[0], bounds]) if self.count else np.zeros(0, dtype=int)
+        stops = np.concatenate([bounds, [self.count]]) if self.count else np.zeros(0, dtype=int)
+        return list(zip(starts.tolist(), stops.tolist()))
+
+    def steps(self, first, last, episode, names = None):
+        """Returns dict of columns of rows of episode with step count in [first, last).
+
+        Args:
+            first, last: Range of env.step_count values.
+            episode (int): Index of episode.
+            names: Names of columns. If none passed, all columns are returned.
+        """
+        # Episode index and step count within an episode never decrease
+        start, stop = np.searchsorted(self['episode'], [episode, episode + 1])
+        steps = self['step'][start:stop]
+        lo = start + int(np.searchsorted(steps, first, side='left'))
+        hi = start + int(np.searchsorted(steps, last, side='left'))
+        return self.slice(lo, hi, names)
@@ -0,0 +1,142 @@
+"""Tests of accumulating infos and environment snapshots. Need only NumPy."""
+import importlib
+import os
+import sys
+import numpy as np
+
+# Package is imported by its directory name, as in benchmarks
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(_root))
+info = importlib.import_module(os.path.basename(_root) + '.info')
+
+class NotInLane(Exception):
+    pass
+
+class FakeEnv:
+    NotInLane = NotInLane
+
+    def __init__(self):
+        self.step_count = 0
+        self.cur_pos = np.zeros(3)
+        self.cur_angle = 0.0
+        self.speed = 0.0
+        self.delta_time = 0.1
+        self.in_lane = True
+
+    def get_dir_vec(self):
+        return np.array([np.cos(self.cur_angle), 0, -np.sin(self.cur_angle)])
+
+    def get_lane_pos2(self, pos, angle):
+        if not self.in_lane:
+            raise NotInLane()
+        return 0.0
+
+def set_state(env, step, x = 0.0, speed = 0.0, in_lane = True):
+    env.step_count = step
+    env.cur_pos = np.array([x, 0.0, 0.0])
+    env.speed = speed
+    env.in_lane = in_lane
+
+def test_distance_sums_moves_between_calls():
+    env = FakeEnv()
+    distance = info.Distance(env)
+    for step, x in [(0, 0.0), (1, 0.5), (3, 1.5)]:
+        set_state(env, step, x)
+        value = distance()
+    assert np.isclose(value, 1.5)
+
+def test_distance_ignores_repeated_step():
+    env = FakeEnv()
+    distance = info.Distance(env)
+    set_state(env, 0, 0.0)
+    distance()
+    set_state(env, 1, 1.0)
+    distance()
+    assert np.isclose(distance(), 1.0)
+
+def test_distance_resets_when_step_count_decreases():
+    env = FakeEnv()
+    distance = info.Distance(env)
+    for step, x in [(0, 0.0), (1, 1.0), (2, 2.0), (0, 10.0), (1, 10.5)]:
+        set_state(env, step, x)
+        value = distance()
+    # Teleport to start of new episode isn't counted
+    assert np.isclose(value, 0.5)
+
+def test_time_out_of_lane_accounts_multi_step_gaps():
+    env = FakeEnv()
+    out_of_lane = info.TimeOutOfLane(env)
+    set_state(env, 0)
+    out_of_lane()
+    set_state(env, 3, in_lane=False)
+    assert np.isclose(out_of_lane(), 3 * env.delta_time)
+    set_state(env, 5, in_lane=True)
+    assert np.isclose(out_of_lane(), 3 * env.delta_time)
+
+def test_time_out_of_lane_resets_when_step_count_decreases():
+    env = FakeEnv()
+    out_of_lane = info.TimeOutOfLane(env)
+    for step in [0, 1, 2]:
+        set_state(env, step, in_lane=False)
+        out_of_lane()
+    set_state(env, 1, in_lane=False)
+    assert out_of_lane() == 0.0
+
+def test_time_inactive_counts_steps_below_threshold():
+    env = FakeEnv()
+    inactive = info.TimeInactive(env, threshold=0.01)
+    for step, speed in [(0, 0.0), (1, 0.0), (4, 0.0), (5, 0.5), (6, 0.001)]:
+        set_state(env, step, speed=speed)
+        value = inactive()
+    assert np.isclose(value, 5 * env.delta_time)
+
+def test_accumulator_reads_passed_env():
+    env, other = FakeEnv(), FakeEnv()
+    distance = info.Distance(env)
+    set_state(other, 0, 0.0)
+    distance(other)
+    set_state(other, 1, 2.0)
+    assert np.isclose(distance(other), 2.0)
+
+def test_snapshot_is_shared_within_step():
+    env = FakeEnv()
+    set_state(env, 0, 1.0)
+    snapshot = info.get_snapshot(env)
+    assert info.get_snapshot(env) is snapshot
+    assert info.BotPos(env)() is snapshot.pos
+
+def test_snapshot_changes_with_step_or_pose():
+    env = FakeEnv()
+    set_state(env, 0, 1.0)
+    first = info.get_snapshot(env)
+    env.cur_angle = 1.0
+    second = info.get_snapshot(env)
+    assert second is not first
+    np.testing.assert_allclose(second.dir, env.get_dir_vec())
+    set_state(env, 1, 2.0)
+    third = info.get_snapshot(env)
+    assert third is not second
+    np.testing.assert_allclose(third.pos, [2.0, 0, 0])
+
+def test_snapshot_arrays_are_read_only_copies():
+    env = FakeEnv()
+    set_state(env, 0, 1.0)
+    pos = info.get_snapshot(env).pos
+    assert not pos.flags.writeable
+    env.cur_pos[0] = 5.0 # Changed in place, as simulator may do
+    np.testing.assert_allclose(pos, [1.0, 0, 0])
+
+def test_snapshot_lane_pos_is_none_out_of_lane():
+    env = FakeEnv()
+    set_state(env, 0, in_lane=False)
+    assert info.get_snapshot(env).lane_pos is None
+    assert not info.IsInLane(env)()
+    set_state(env, 1, in_lane=True)
+    assert info.IsInLane(env)()
+
+def test_snapshots_are_kept_per_env():
+    env, other = FakeEnv(), FakeEnv()
+    set_state(env, 0, 1.0)
+    set_state(other, 0, 1.0)
+    assert info.get_snapshot(env) is not info.get_snapshot(other)
+    assert info.get_snapshot(env).env is env
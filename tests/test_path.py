@@ -0,0 +1,90 @@
+"""Tests of positions kept by drawable.Path. Need only NumPy."""
+import importlib
+import os
+import sys
+import numpy as np
+
+# Package is imported by its directory name, as in benchmarks
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(_root))
+drawable = importlib.import_module(os.path.basename(_root) + '.drawable')
+
+class FakeEnv:
+    def __init__(self):
+        self.step_count = 0
+        self.cur_pos = np.zeros(3)
+
+def record_all(path, positions):
+    env = FakeEnv()
+    for step, pos in enumerate(positions):
+        env.step_count = step
+        env.cur_pos = np.array(pos, dtype=float)
+        path.record(env)
+
+def test_positions_are_kept_in_order():
+    path = drawable.Path(recent=3, history=8)
+    record_all(path, [(0.1 * i, 0, 0) for i in range(5)])
+
+    # Two oldest positions moved from recent ones to history
+    pts, breaks = path.get_points()
+    np.testing.assert_allclose(pts[:, 0], [0.0, 0.1, 0.2, 0.3, 0.4], rtol=1e-6)
+    assert list(breaks) == [True, False, False, False, False] # First position starts path
+
+def test_record_ignores_repeated_step():
+    path = drawable.Path(recent=3, history=8)
+    env = FakeEnv()
+    path.record(env)
+    env.cur_pos = np.array([1.0, 0, 0])
+    path.record(env)
+    pts, _ = path.get_points()
+    np.testing.assert_allclose(pts, [[0, 0, 0]])
+
+def test_reset_and_teleport_break_path():
+    path = drawable.Path(recent=8, history=8, teleport_dist=0.5)
+    env = FakeEnv()
+    for step, x in [(0, 0.0), (1, 0.1), (2, 5.0), (0, 5.1)]:
+        env.step_count = step
+        env.cur_pos = np.array([x, 0, 0])
+        path.record(env)
+    _, breaks = path.get_points()
+    assert list(breaks) == [True, False, True, True]
+
+def test_clear_removes_positions():
+    path = drawable.Path(recent=2, history=4)
+    record_all(path, [(0.1 * i, 0, 0) for i in range(5)])
+    path.clear()
+    pts, breaks = path.get_points()
+    assert len(pts) == 0 and len(breaks) == 0
+
+def test_number_of_positions_is_bounded():
+    path = drawable.Path(recent=4, history=8)
+    record_all(path, [(0.01 * i, 0, 0) for i in range(1000)])
+
+    pts, breaks = path.get_points()
+    assert len(pts) <= 12
+    # Oldest position and latest ones at full resolution are kept
+    np.testing.assert_allclose(pts[0, 0], 0.0)
+    np.testing.assert_allclose(pts[-4:, 0], [9.96, 9.97, 9.98, 9.99], rtol=1e-6)
+    assert np.all(np.diff(pts[:, 0]) > 0)
+    assert list(breaks) == [True] + [False] * (len(pts) - 1)
+
+def test_decimation_keeps_break_of_dropped_last_position():
+    path = drawable.Path(recent=1, history=4, teleport_dist=0.5)
+    positions = [(0.1 * i, 0, 0) for i in range(3)] + [(10.0, 0, 0), (10.1, 0, 0), (10.2, 0, 0)]
+    record_all(path, positions)
+
+    # History got positions 0-3 (teleport before 3), then was decimated when 4 was pushed
+    pts, breaks = path.get_points()
+    np.testing.assert_allclose(pts[:, 0], [0.0, 0.2, 10.1, 10.2], rtol=1e-6)
+    # Segment from position 2 to 4 crosses the teleport
+    assert list(breaks) == [True, False, True, False]
+
+def test_decimation_merges_breaks_of_dropped_positions():
+    path = drawable.Path(recent=1, history=4, teleport_dist=0.5)
+    positions = [(0.0, 0, 0), (5.0, 0, 0), (5.1, 0, 0), (5.2, 0, 0), (5.3, 0, 0), (5.4, 0, 0)]
+    record_all(path, positions)
+
+    # Dropped position 1 started a new segment, so segment 0 -> 2 is broken
+    pts, breaks = path.get_points()
+    np.testing.assert_allclose(pts[:, 0], [0.0, 5.1, 5.3, 5.4], rtol=1e-6)
+    assert list(breaks) == [True, True, False, False]
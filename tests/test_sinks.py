@@ -0,0 +1,63 @@
+"""Tests of frame sinks storing frames in .npy files. Need only NumPy."""
+import importlib
+import os
+import sys
+import numpy as np
+
+# Package is imported by its directory name, as in benchmarks
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(_root))
+sinks = importlib.import_module(os.path.basename(_root) + '.sinks')
+
+def make_frames(count, height = 4, width = 6):
+    rng = np.random.RandomState(0)
+    return rng.randint(0, 256, size=(count, height, width, 3)).astype(np.uint8)
+
+def test_raw_frame_store_grows_past_capacity(tmp_path):
+    path = str(tmp_path / 'frames.npy')
+    frames = make_frames(5)
+    store = sinks.RawFrameStore(path, capacity=2)
+    store.open(6, 4, 15)
+    for frame in frames:
+        store.write(frame)
+    store.close()
+
+    np.testing.assert_array_equal(np.load(path), frames)
+
+def test_raw_frame_store_truncates_unused_capacity(tmp_path):
+    path = str(tmp_path / 'frames.npy')
+    frames = make_frames(3)
+    store = sinks.RawFrameStore(path, capacity=16)
+    store.open(6, 4, 15)
+    for frame in frames:
+        store.write(frame)
+    store.close()
+
+    loaded = np.load(path, mmap_mode='r')
+    assert loaded.shape == (3, 4, 6, 3)
+    np.testing.assert_array_equal(loaded, frames)
+    header_size = os.path.getsize(path) - frames.nbytes
+    assert header_size % 64 == 0
+
+def test_raw_frame_store_without_frames_is_empty_array(tmp_path):
+    path = str(tmp_path / 'frames.npy')
+    store = sinks.RawFrameStore(path, capacity=4)
+    store.open(6, 4, 15)
+    store.close()
+
+    assert np.load(path).shape == (0, 4, 6, 3)
+
+def test_raw_frame_store_can_be_reopened(tmp_path):
+    path = str(tmp_path / 'frames.npy')
+    store = sinks.RawFrameStore(path, capacity=2)
+    store.open(6, 4, 15)
+    for frame in make_frames(3):
+        store.write(frame)
+    store.close()
+    frames = make_frames(2, 2, 2)
+    store.open(2, 2, 15)
+    for frame in frames:
+        store.write(frame)
+    store.close()
+
+    np.testing.assert_array_equal(np.load(path), frames)
@@ -0,0 +1,97 @@
+"""Tests of .npy appender and telemetry store. Need only NumPy."""
+import importlib
+import os
+import sys
+import numpy as np
+
+# Package is imported by its directory name, as in benchmarks
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(_root))
+sinks = importlib.import_module(os.path.basename(_root) + '.sinks')
+telemetry = importlib.import_module(os.path.basename(_root) + '.telemetry')
+
+class FakeEnv:
+    def __init__(self):
+        self.step_count = 0
+        self.speed = 0.0
+        self.cur_pos = np.zeros(3)
+
+def test_npy_appender_file_is_loadable_after_each_append(tmp_path):
+    path = str(tmp_path / 'rows.npy')
+    appender = sinks.NpyAppender(path, np.float32, (2,))
+    assert np.load(path).shape == (0, 2)
+    appender.append([[1, 2], [3, 4]])
+    np.testing.assert_array_equal(np.load(path), [[1, 2], [3, 4]])
+    appender.append(np.array([[5, 6]]))
+    appender.close()
+
+    loaded = np.load(path, mmap_mode='r')
+    assert loaded.dtype == np.float32
+    np.testing.assert_array_equal(loaded, [[1, 2], [3, 4], [5, 6]])
+
+def test_npy_appender_keeps_structured_rows(tmp_path):
+    path = str(tmp_path / 'records.npy')
+    dtype = np.dtype([('step', '<i8'), ('pos', '<f4', (3,))])
+    rows = np.zeros(3, dtype=dtype)
+    rows['step'] = [0, 1, 2]
+    rows['pos'][:, 0] = [0.5, 1.5, 2.5]
+    appender = sinks.NpyAppender(path, dtype)
+    appender.append(rows[:1])
+    appender.append(rows[1:])
+    appender.close()
+
+    loaded = np.load(path)
+    assert loaded.dtype == dtype
+    np.testing.assert_array_equal(loaded, rows)
+
+def record_run(path, steps, chunk_steps = 2):
+    """Records runs of passed step counts (a reset where count decreases)."""
+    env = FakeEnv()
+    writer = telemetry.TelemetryWriter(path, env, {
+        'speed': lambda env: env.speed,
+        'pos': lambda env: env.cur_pos,
+    }, chunk_steps=chunk_steps)
+    for i, step in enumerate(steps):
+        env.step_count = step
+        env.speed = float(i)
+        env.cur_pos = np.array([i, 0.0, -i])
+        writer.record()
+    writer.close()
+
+def test_telemetry_round_trip(tmp_path):
+    path = str(tmp_path / 'telemetry')
+    record_run(path, [0, 1, 2, 3, 4])
+    reader = telemetry.TelemetryReader(path)
+
+    assert len(reader) == 5
+    assert sorted(reader.metrics) == ['pos', 'speed']
+    np.testing.assert_array_equal(reader['step'], [0, 1, 2, 3, 4])
+    np.testing.assert_allclose(reader['speed'], [0, 1, 2, 3, 4])
+    assert reader['pos'].shape == (5, 3)
+    np.testing.assert_allclose(reader.slice(1, 3, ['pos'])['pos'][:, 2], [-1, -2])
+
+def test_telemetry_episodes_split_where_step_count_decreases(tmp_path):
+    path = str(tmp_path / 'telemetry')
+    record_run(path, [0, 1, 2, 0, 1, 0])
+    reader = telemetry.TelemetryReader(path)
+
+    np.testing.assert_array_equal(reader['episode'], [0, 0, 0, 1, 1, 2])
+    assert reader.episodes() == [(0, 3), (3, 5), (5, 6)]
+
+def test_telemetry_steps_selects_range_of_episode(tmp_path):
+    path = str(tmp_path / 'telemetry')
+    record_run(path, [0, 2, 4, 6, 0, 1, 2, 3])
+    reader = telemetry.TelemetryReader(path)
+
+    rows = reader.steps(2, 6, episode=0)
+    np.testing.assert_array_equal(rows['step'], [2, 4])
+    np.testing.assert_allclose(rows['speed'], [1, 2])
+    rows = reader.steps(1, 100, episode=1, names=['speed'])
+    assert list(rows) == ['speed']
+    np.testing.assert_allclose(rows['speed'], [5, 6, 7])
+    assert len(reader.steps(0, 10, episode=2)['step']) == 0
+
+def test_telemetry_reader_of_empty_directory(tmp_path):
+    reader = telemetry.TelemetryReader(str(tmp_path))
+    assert len(reader) == 0
+    assert reader.metrics == []
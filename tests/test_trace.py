@@ -0,0 +1,94 @@
+"""Tests of state-trace logging and reading. Need only NumPy."""
+import importlib
+import os
+import sys
+import numpy as np
+import pytest
+
+# Package is imported by its directory name, as in benchmarks
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(_root))
+trace = importlib.import_module(os.path.basename(_root) + '.trace')
+
+class FakeObject:
+    def __init__(self, pos, static):
+        self.pos = np.array(pos, dtype=float)
+        self.angle = 0.0
+        self.static = static
+
+class FakeEnv:
+    def __init__(self):
+        self.step_count = 0
+        self.cur_pos = np.zeros(3)
+        self.cur_angle = 0.0
+        self.speed = 0.0
+        self.objects = [FakeObject((1, 0, 1), True), FakeObject((2, 0, 2), False)]
+
+def set_state(env, i, step):
+    env.step_count = step
+    env.cur_pos = np.array([0.5 * i, 0.0, 1.0])
+    env.cur_angle = 0.1 * i
+    env.speed = 0.2 * i
+    env.objects[1].pos = np.array([2.0 + i, 0.0, 2.0])
+    env.objects[1].angle = -0.1 * i
+
+def write_trace(path, steps, chunk_steps = 2):
+    env = FakeEnv()
+    writer = trace.TraceWriter(path, env, {
+        'speed2': lambda env: 2 * env.speed,
+        'pos2': lambda env: env.cur_pos[[0, 2]],
+    }, chunk_steps=chunk_steps)
+    for i, step in enumerate(steps):
+        set_state(env, i, step)
+        writer.record()
+    return writer
+
+def test_trace_round_trip_restores_state(tmp_path):
+    path = str(tmp_path / 'trace.npy')
+    write_trace(path, [0, 1, 2, 3, 4]).close()
+    reader = trace.TraceReader(path)
+    assert len(reader) == 5
+    assert reader.infos == ['speed2', 'pos2']
+
+    env = FakeEnv()
+    reader.apply(env, 3)
+    assert env.step_count == 3
+    np.testing.assert_allclose(env.cur_pos, [1.5, 0, 1], rtol=1e-6)
+    assert np.isclose(env.cur_angle, 0.3)
+    assert np.isclose(env.speed, 0.6)
+    # Only objects which aren't static are logged
+    np.testing.assert_allclose(env.objects[0].pos, [1, 0, 1])
+    np.testing.assert_allclose(env.objects[1].pos, [5, 0, 2], rtol=1e-6)
+    assert np.isclose(env.objects[1].angle, -0.3)
+
+def test_trace_value_returns_logged_info(tmp_path):
+    path = str(tmp_path / 'trace.npy')
+    write_trace(path, [0, 1, 2]).close()
+    reader = trace.TraceReader(path)
+    env = FakeEnv()
+    reader.apply(env, 2)
+
+    assert np.isclose(trace.TraceValue(env, 'speed2')(), 0.8)
+    np.testing.assert_allclose(trace.TraceValue(env, 'pos2')(), [1.0, 1.0])
+    assert trace.TraceValue(env, 'speed2', "speed: ").get_str() == "speed: 0.8"
+
+def test_trace_episode_starts_where_step_count_decreases(tmp_path):
+    path = str(tmp_path / 'trace.npy')
+    write_trace(path, [0, 1, 2, 0, 1, 0]).close()
+    reader = trace.TraceReader(path)
+
+    assert list(reader.episode_starts()) == [0, 3, 5]
+
+def test_trace_is_readable_before_close(tmp_path):
+    path = str(tmp_path / 'trace.npy')
+    writer = write_trace(path, [0, 1, 2, 3, 4])
+    # Chunks of 2 records were written, last record is still buffered
+    reader = trace.TraceReader(path)
+    assert len(reader) == 4
+    assert list(reader.records['step']) == [0, 1, 2, 3]
+    writer.close()
+    assert len(trace.TraceReader(path)) == 5
+
+def test_trace_reserved_info_name_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        trace.TraceWriter(str(tmp_path / 'trace.npy'), FakeEnv(), {'pos': lambda env: 0})
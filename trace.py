@@ -0,0 +1,245 @@
+"""Module with state-trace logging and deferred replay rendering.
+
+During a run TraceWriter logs small per-step state of environment (bot's pose
+and speed, poses of dynamic objects, step count and values of Info objects)
+into a .npy file of records. Later replay reconstructs environment's state from
+the trace and renders frames with Recorder in several processes.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import weakref
+import numpy as np
+from .info import Info
+from .sinks import NpyAppender, concat_segments
+
+STATE_FIELDS = ['step', 'pos', 'angle', 'speed', 'obj_pos', 'obj_angle']
+
+class TraceWriter:
+    """Logs per-step state of environment into a .npy file of records.
+
+    File holds 1-D structured array with fields 'step', 'pos', 'angle', 'speed',
+    'obj_pos', 'obj_angle' (poses of objects which aren't static) and one field
+    per logged Info. Poses and speed are stored as float32, Info values as
+    float64. File can be loaded with np.load(path, mmap_mode='r') or
+    TraceReader. Records are buffered in memory and appended in chunks.
+
+    Args:
+        path: Path of .npy file.
+        env: Environment to log.
+        infos (dict): Names mapped to Info objects whose values are logged. Values
+            must be numbers or fixed-size numeric arrays.
+        chunk_steps (int): Number of records buffered before they are written.
+
+    Note: record should be called after every step of the environment.
+    """
+    def __init__(self, path, env, infos = {}, chunk_steps = 1024):
+        for name in infos:
+            if name in STATE_FIELDS:
+                raise ValueError("Info name '{}' is reserved.".format(name))
+        assert chunk_steps > 0
+        self.path = path
+        self.env = env
+        self.infos = dict(infos)
+        self.chunk_steps = chunk_steps
+        self.count = 0
+        self.dtype = None
+        self._appender = None
+        self._buffer = None
+        self._buffered = 0
+
+    def record(self, env = None):
+        """Appends record of current state of environment."""
+        if env == None:
+            env = self.env
+        objects = [obj for obj in env.objects if not getattr(obj, 'static', False)]
+        values = [np.asarray(info(env), dtype=np.float64) for info in self.infos.values()]
+        if self._appender is None:
+            self._open(len(objects), values)
+        assert len(objects) == self.dtype['obj_angle'].shape[0] # Objects can't be added
+        if self._buffered == self.chunk_steps:
+            self._flush()
+
+        rec = self._buffer[self._buffered]
+        rec['step']  = env.step_count
+        rec['pos']   = env.cur_pos
+        rec['angle'] = env.cur_angle
+        rec['speed'] = env.speed
+        for i, obj in enumerate(objects):
+            rec['obj_pos'][i]   = obj.pos
+            rec['obj_angle'][i] = obj.angle
+        for name, value in zip(self.infos, values):
+            rec[name] = value
+        self._buffered += 1
+        self.count += 1
+
+    def close(self):
+        """Writes buffered records and final header."""
+        if self._appender is None:
+            return
+        self._flush()
+        self._appender.close()
+        self._appender = None
+
+    def _open(self, object_count, values):
+        fields = [
+            ('step', '<i8'),
+            ('pos', '<f4', (3,)),
+            ('angle', '<f4'),
+            ('speed', '<f4'),
+            ('obj_pos', '<f4', (object_count, 3)),
+            ('obj_angle', '<f4', (object_count,)),
+        ]
+        fields += [(name, '<f8', value.shape) for name, value in zip(self.infos, values)]
+        self.dtype = np.dtype(fields)
+        self._buffer = np.zeros(self.chunk_steps, dtype=self.dtype)
+        self._buffered = 0
+        self._appender = NpyAppender(self.path, self.dtype)
+
+    def _flush(self):
+        self._appender.append(self._buffer[:self._buffered])
+        self._buffered = 0
+
+class TraceReader:
+    """Reads trace written by TraceWriter.
+
+    Records are memory-mapped. Their number is taken from file size, so trace of
+    a run which was killed before TraceWriter.close can be read too.
+
+    Args:
+        path: Path of .npy trace file.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                _, _, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                _, _, dtype = np.lib.format.read_array_header_2_0(f)
+            offset = f.tell()
+        self.dtype = dtype
+        count = (os.path.getsize(path) - offset) // dtype.itemsize
+        self.records = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(count,))
+        self.infos = [name for name in dtype.names if name not in STATE_FIELDS]
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        return self.records[index]
+
+    def episode_starts(self):
+        """Returns indices of records starting an episode (step count decreased)."""
+        steps = self.records['step']
+        if len(steps) == 0:
+            return np.zeros(0, dtype=int)
+        return np.concatenate([[0], np.flatnonzero(np.diff(steps) < 0) + 1])
+
+    def apply(self, env, index):
+        """Sets state of environment to the one of record with passed index.
+
+        Environment must have the same map and objects as the logged one.
+        Logged Info values are available through TraceValue.
+        """
+        rec = self.records[index]
+        env.step_count = int(rec['step'])
+        env.cur_pos    = np.array(rec['pos'], dtype=np.float64)
+        env.cur_angle  = float(rec['angle'])
+        env.speed      = float(rec['speed'])
+        objects = [obj for obj in env.objects if not getattr(obj, 'static', False)]
+        assert len(objects) == len(rec['obj_angle'])
+        for obj, pos, angle in zip(objects, rec['obj_pos'], rec['obj_angle']):
+            obj.pos = np.array(pos, dtype=np.float64)
+            obj.angle = float(angle)
+            if hasattr(obj, 'y_rot'):
+                obj.y_rot = np.rad2deg(obj.angle)
+        _replayed[env] = rec
+
+_replayed = weakref.WeakKeyDictionary() # Environment -> last applied record
+
+class TraceValue(Info):
+    """Logged value of an Info, available when environment's state is replayed.
+
+    Use it in place of Infos which can't be recomputed from a single step, e.g.
+    accumulators like info.Distance.
+
+    Args:
+        env: Environment replayed by TraceReader.apply.
+        name (string): Name Info was logged under.
+        prefix (string): Prefix concatenated to stringified value when get_str called.
+    """
+    def __init__(self, env, name, prefix = ""):
+        self.env = env
+        self.name = name
+        self.prefix = prefix
+
+    def __call__(self, env = None):
+        if env == None:
+            t_env = self.env
+        else:
+            t_env = env
+        value = _replayed[t_env][self.name]
+        return value if value.shape else float(value)
+
+    def get_str(self):
+        value = self()
+        if np.isscalar(value):
+            return self.prefix + str(round(value, 2))
+        return self.prefix + str([round(val, 2) for val in value])
+
+def replay(trace_path, file, make_env, make_recorder, workers = None,
+    segment_frames = 900, stride = 1, stitch = True
+):
+    """Renders video of logged run from its trace in parallel processes.
+
+    Frames are split into segments rendered by worker processes, each with its
+    own environment and Recorder. Segments are stitched into the final
+    videofile like sinks.SegmentedVideoSink does.
+
+    Args:
+        trace_path: Path of trace written by TraceWriter.
+        file: Path of final videofile.
+        make_env: Picklable callable returning environment with logged map,
+            e.g. module-level function. Called once in each worker.
+        make_recorder: Picklable callable (path, env) returning Recorder with
+            subframes set, which writes videofile at path.
+        workers (int): Number of worker processes. If none passed, number of CPUs.
+        segment_frames (int): Number of frames rendered by one task.
+        stride (int): Render every stride-th record.
+    """
+    assert segment_frames > 0 and stride > 0
+    count = len(TraceReader(trace_path))
+    indices = range(0, count, stride)
+    name, ext = os.path.splitext(file)
+    tasks = []
+    for i, start in enumerate(range(0, len(indices), segment_frames)):
+        segment = "{}_seg{:05d}{}".format(name, i, ext)
+        tasks.append((indices[start:start + segment_frames], segment))
+
+    # Worker processes create their own OpenGL contexts, which can't be forked
+    pool = ProcessPoolExecutor(workers or os.cpu_count() or 1,
+        mp_context=multiprocessing.get_context('spawn'))
+    with pool:
+        futures = [pool.submit(_replay_segment, trace_path, task_indices, segment,
+            make_env, make_recorder) for task_indices, segment in tasks]
+        for future in futures:
+            future.result()
+    concat_segments(file, [segment for _, segment in tasks], stitch)
+
+_worker_env = None # Environment of worker process, reused by its tasks
+
+def _replay_segment(trace_path, indices, path, make_env, make_recorder):
+    """Renders records with passed indices into videofile. Runs in worker process."""
+    global _worker_env
+    if _worker_env is None:
+        _worker_env = make_env()
+    env = _worker_env
+    trace = TraceReader(trace_path)
+    recorder = make_recorder(path, env)
+    try:
+        for index in indices:
+            trace.apply(env, index)
+            recorder.render()
+    finally:
+        recorder.close()